@@ -1,42 +1,134 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import FileResponse
+from starlette.routing import Match
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, monitoring, timeout as mongo_timeout
+from pymongo.read_preferences import SecondaryPreferred
+from pymongo.errors import DuplicateKeyError
 from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 import os
 import logging
 import jwt
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Awaitable, Callable
+from collections import OrderedDict, Counter, deque
+from concurrent.futures import ProcessPoolExecutor
 import uuid
 import hashlib
+import hmac
+import random
+import socket
+import sys
+import threading
+import time
+import asyncio
 from bson import ObjectId
 import json
+import csv
+import math
+from functools import lru_cache
+from contextlib import asynccontextmanager
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# MongoDB connections, opened by the app lifespan (see create_app). ``db`` serves
+# ingest and anything that must read its own writes; ``read_db`` serves dashboard
+# and history reads from its own pool, preferring secondaries.
+client: Optional[AsyncIOMotorClient] = None
+read_client: Optional[AsyncIOMotorClient] = None
+db = None
+read_db = None
 
-# Create the main app without a prefix
-app = FastAPI()
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """Counts connection checkouts and time spent waiting for one, per client."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.lock = threading.Lock()
+        self.local = threading.local()  # checkouts start and finish on one thread
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.in_use = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def connection_check_out_started(self, event):
+        self.local.started = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        wait = time.perf_counter() - getattr(self.local, "started", time.perf_counter())
+        with self.lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def connection_check_out_failed(self, event):
+        with self.lock:
+            self.checkout_failures += 1
+
+    def connection_checked_in(self, event):
+        with self.lock:
+            self.in_use -= 1
+
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_cleared(self, event): pass
+    def pool_closed(self, event): pass
+    def connection_created(self, event): pass
+    def connection_ready(self, event): pass
+    def connection_closed(self, event): pass
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "checkouts": self.checkouts,
+                "checkout_failures": self.checkout_failures,
+                "in_use": self.in_use,
+                "avg_wait_ms": round(self.total_wait / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                "max_wait_ms": round(self.max_wait * 1000, 3)
+            }
+
+pool_metrics: Dict[str, PoolMetrics] = {}
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
+ws_router = APIRouter()
 
 # Security
 security = HTTPBearer()
 SECRET_KEY = "your-secret-key-change-in-production"
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")  # admin endpoints are disabled when unset
 
 # WebSocket connection manager
+NOTIFY_COALESCE_SECONDS = 0.25
+NOTIFY_DIGEST_SECONDS = 60
+# Notifications that repeat on every fix inside a zone; only the repeats are digested
+DIGEST_MESSAGE_TYPES = {"geofence_alert"}
+
 class ConnectionManager:
+    """Per-parent WebSocket fan-out with burst coalescing.
+
+    Notifications arriving within ``NOTIFY_COALESCE_SECONDS`` of each other go out
+    as one ``batch`` frame, encoded once. For types in ``DIGEST_MESSAGE_TYPES`` the
+    first occurrence of a message goes out right away; identical repeats within
+    the next ``NOTIFY_DIGEST_SECONDS`` are counted and sent as one ``digest`` frame.
+    Frame compression is negotiated by uvicorn (permessage-deflate is on by default).
+    """
+
     def __init__(self):
         self.active_connections: Dict[str, WebSocket] = {}
+        self.pending: Dict[str, List[dict]] = {}
+        self.digests: Dict[str, Dict[str, Any]] = {}
+        self.flush_tasks: Dict[str, asyncio.Task] = {}
+        self.digest_tasks: Dict[str, asyncio.Task] = {}
 
     async def connect(self, websocket: WebSocket, parent_id: str):
         await websocket.accept()
@@ -45,13 +137,161 @@ class ConnectionManager:
     def disconnect(self, parent_id: str):
         if parent_id in self.active_connections:
             del self.active_connections[parent_id]
+        self.pending.pop(parent_id, None)
+        self.digests.pop(parent_id, None)
+        for tasks in (self.flush_tasks, self.digest_tasks):
+            task = tasks.pop(parent_id, None)
+            if task and task is not asyncio.current_task():
+                task.cancel()
 
     async def send_personal_message(self, message: dict, parent_id: str):
-        if parent_id in self.active_connections:
-            await self.active_connections[parent_id].send_text(json.dumps(message))
+        if parent_id not in self.active_connections:
+            return
+        
+        if message.get("type") in DIGEST_MESSAGE_TYPES:
+            key = json.dumps(message, sort_keys=True, default=str)
+            digest = self.digests.setdefault(parent_id, {})
+            if parent_id not in self.digest_tasks:
+                self.digest_tasks[parent_id] = asyncio.create_task(self.flush_digest(parent_id))
+            if key in digest:
+                digest[key]["count"] += 1
+                return
+            digest[key] = {**message, "count": 0}  # counts repeats only
+        
+        self.pending.setdefault(parent_id, []).append(message)
+        if parent_id not in self.flush_tasks:
+            self.flush_tasks[parent_id] = asyncio.create_task(self.flush_pending(parent_id))
+
+    async def flush_pending(self, parent_id: str):
+        await asyncio.sleep(NOTIFY_COALESCE_SECONDS)
+        self.flush_tasks.pop(parent_id, None)
+        events = self.pending.pop(parent_id, [])
+        if not events:
+            return
+        # A lone event keeps its original shape for existing clients
+        await self.send_frame(parent_id, events[0] if len(events) == 1 else {"type": "batch", "events": events})
+
+    async def flush_digest(self, parent_id: str):
+        await asyncio.sleep(NOTIFY_DIGEST_SECONDS)
+        self.digest_tasks.pop(parent_id, None)
+        events = [event for event in self.digests.pop(parent_id, {}).values() if event["count"]]
+        if not events:
+            return
+        counts: Dict[str, int] = {}
+        for event in events:
+            counts[event["type"]] = counts.get(event["type"], 0) + event["count"]
+        await self.send_frame(parent_id, {
+            "type": "digest",
+            "window_seconds": NOTIFY_DIGEST_SECONDS,
+            "counts": counts,
+            "events": events
+        })
+
+    async def send_frame(self, parent_id: str, frame: dict):
+        websocket = self.active_connections.get(parent_id)
+        if websocket is None:
+            return
+        try:
+            await websocket.send_text(json.dumps(frame, separators=(",", ":"), default=str))
+        except Exception:
+            logging.getLogger(__name__).warning("Dropping WebSocket for parent %s after failed send", parent_id)
+            self.disconnect(parent_id)
 
 manager = ConnectionManager()
 
+# Idempotency for device ingest endpoints
+IDEMPOTENCY_CACHE_SIZE = 10000
+IDEMPOTENCY_KEY_TTL_SECONDS = 24 * 60 * 60
+IDEMPOTENCY_RESERVATION_SECONDS = 60  # a crashed request's key can be retried after this
+
+class IdempotencyCache:
+    """Bounded in-memory set of recently answered request keys.
+
+    The ``idempotency_keys`` collection (unique index on ``key``) is the source of
+    truth; this cache only lets hot retries skip the database round trip.
+    """
+
+    def __init__(self, maxsize: int = IDEMPOTENCY_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.responses: "OrderedDict[str, dict]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[dict]:
+        response = self.responses.get(key)
+        if response is not None:
+            self.responses.move_to_end(key)
+        return response
+
+    def set(self, key: str, response: dict):
+        self.responses[key] = response
+        self.responses.move_to_end(key)
+        while len(self.responses) > self.maxsize:
+            self.responses.popitem(last=False)
+
+idempotency_cache = IdempotencyCache()
+
+# Change notifications for device app-control sync
+APP_CONTROLS_MAX_WAIT_SECONDS = 60
+APP_CONTROLS_PENDING_SECONDS = 30  # an unfinished control write older than this is abandoned
+APP_CONTROLS_SETTLE_ATTEMPTS = 20
+
+class ControlsChangeNotifier:
+    """Wakes long-polling devices of a teen when its app controls change."""
+
+    def __init__(self):
+        self.events: Dict[str, asyncio.Event] = {}
+
+    async def wait(self, teen_id: str, timeout: float) -> bool:
+        event = self.events.setdefault(teen_id, asyncio.Event())
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def notify(self, teen_id: str):
+        event = self.events.pop(teen_id, None)
+        if event:
+            event.set()
+
+controls_notifier = ControlsChangeNotifier()
+
+# Hot lookup caches for device ingest
+INGEST_CACHE_TTL_SECONDS = 30
+INGEST_CACHE_SIZE = 10000
+
+class TTLCache:
+    """Small bounded per-process cache whose entries expire after ``ttl`` seconds.
+
+    Writes in this process invalidate their keys directly; the TTL bounds how long
+    another worker's change can go unseen.
+    """
+
+    def __init__(self, ttl: float = INGEST_CACHE_TTL_SECONDS, maxsize: int = INGEST_CACHE_SIZE):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, key: str) -> Any:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self.entries[key]
+            return None
+        return entry[1]
+
+    def set(self, key: str, value: Any):
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, key: str):
+        self.entries.pop(key, None)
+
+teen_cache = TTLCache()
+geofence_cache = TTLCache()  # parent_id -> GeofenceIndex
+
 # Models
 class Parent(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -69,6 +309,8 @@ class Teen(BaseModel):
     age: Optional[int] = None
     screen_time_limits: Dict[str, int] = Field(default_factory=dict)  # day: minutes
     bedtime_schedule: Dict[str, str] = Field(default_factory=dict)  # day: time
+    controls_version: int = 0  # bumped on every app control change
+    timezone: str = "UTC"  # IANA name, used for daily screen time rollover
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class Location(BaseModel):
@@ -80,9 +322,21 @@ class Location(BaseModel):
     address: Optional[str] = None
     timestamp: datetime = Field(default_factory=datetime.utcnow)
 
-class Geofence(BaseModel):
+class Visit(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     teen_id: str
+    latitude: float  # stay centroid
+    longitude: float
+    address: Optional[str] = None
+    arrived_at: datetime
+    left_at: datetime
+    dwell_minutes: float
+
+class Geofence(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    teen_id: Optional[str] = None  # set for single-teen geofences
+    parent_id: Optional[str] = None
+    teen_ids: List[str] = Field(default_factory=list)  # every teen the geofence applies to
     name: str
     latitude: float
     longitude: float
@@ -107,7 +361,10 @@ class AppControl(BaseModel):
     package_name: str
     is_blocked: bool = False
     time_limit: Optional[int] = None  # minutes per day
+    version: int = 0  # teen controls_version at the last change
+    deleted: bool = False
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
 
 class WebHistory(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -115,6 +372,8 @@ class WebHistory(BaseModel):
     url: str
     title: str
     visit_count: int = 1
+    domain: Optional[str] = None
+    category: Optional[str] = None
     timestamp: datetime = Field(default_factory=datetime.utcnow)
 
 class Alert(BaseModel):
@@ -141,6 +400,7 @@ class TeenCreate(BaseModel):
     device_id: str
     phone_number: Optional[str] = None
     age: Optional[int] = None
+    timezone: str = "UTC"
 
 class LocationCreate(BaseModel):
     teen_id: str
@@ -148,23 +408,32 @@ class LocationCreate(BaseModel):
     longitude: float
     accuracy: Optional[float] = None
     address: Optional[str] = None
+    timestamp: Optional[datetime] = None  # when the fix was taken, for fixes queued offline
+    event_id: Optional[str] = None  # client-generated id used for retry dedupe
+
+GEOFENCE_MAX_RADIUS_M = 50000
 
 class GeofenceCreate(BaseModel):
-    teen_id: str
+    teen_id: Optional[str] = None
+    teen_ids: Optional[List[str]] = None  # shared family geofence
     name: str
-    latitude: float
-    longitude: float
-    radius: float
+    latitude: float = Field(..., ge=-90, le=90)
+    longitude: float = Field(..., ge=-180, le=180)
+    radius: float = Field(..., gt=0, le=GEOFENCE_MAX_RADIUS_M)  # meters
     type: str = "safe"
     notify_on_enter: bool = True
     notify_on_exit: bool = True
 
+class TimezoneUpdate(BaseModel):
+    timezone: str  # IANA name, e.g. America/New_York
+
 class AppUsageCreate(BaseModel):
     teen_id: str
     app_name: str
     package_name: str
     usage_time: int
     date: str
+    event_id: Optional[str] = None
 
 class AppControlCreate(BaseModel):
     teen_id: str
@@ -172,10 +441,16 @@ class AppControlCreate(BaseModel):
     is_blocked: bool = False
     time_limit: Optional[int] = None
 
+class AlertsMarkRead(BaseModel):
+    alert_ids: Optional[List[str]] = None
+    up_to: Optional[datetime] = None  # mark everything created at or before this time
+    teen_id: Optional[str] = None
+
 class WebHistoryCreate(BaseModel):
     teen_id: str
     url: str
     title: str
+    event_id: Optional[str] = None
 
 # Utility functions
 def hash_password(password: str) -> str:
@@ -200,6 +475,204 @@ async def get_current_parent(credentials: HTTPAuthorizationCredentials = Depends
     except jwt.JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
+async def run_idempotent(scope: str, teen_id: str, key: Optional[str], handler: Callable[[], Awaitable[dict]]) -> dict:
+    """Run an ingest handler at most once per (scope, teen, key).
+
+    Retries carrying a key that was already answered get the stored response back
+    without touching the target collections. Requests without a key run as before.
+    """
+    if not key:
+        return await handler()
+
+    scoped_key = f"{scope}:{teen_id}:{key}"
+    cached = idempotency_cache.get(scoped_key)
+    if cached is not None:
+        return cached
+
+    # Reserve the key first so concurrent retries cannot both run the handler. The
+    # reservation is a lease: if its holder died, a later retry takes it over.
+    reservation = str(uuid.uuid4())
+    now = datetime.utcnow()
+    reserved_until = now + timedelta(seconds=IDEMPOTENCY_RESERVATION_SECONDS)
+    try:
+        await db.idempotency_keys.insert_one({
+            "key": scoped_key,
+            "response": None,
+            "reservation": reservation,
+            "reserved_until": reserved_until,
+            "created_at": now
+        })
+    except DuplicateKeyError:
+        existing = await db.idempotency_keys.find_one({"key": scoped_key})
+        if existing and existing.get("response") is not None:
+            idempotency_cache.set(scoped_key, existing["response"])
+            return existing["response"]
+        taken_over = await db.idempotency_keys.find_one_and_update(
+            {"key": scoped_key, "response": None, "$or": [
+                {"reserved_until": {"$lt": now}},
+                {"reserved_until": {"$exists": False}}
+            ]},
+            {"$set": {"reservation": reservation, "reserved_until": reserved_until}}
+        )
+        if taken_over is None:
+            raise HTTPException(status_code=409, detail="Request with this key is already in progress")
+
+    try:
+        response = await handler()
+    except BaseException:
+        # Release the reservation so the device can retry a failed or cancelled request
+        await db.idempotency_keys.delete_one({"key": scoped_key, "reservation": reservation})
+        raise
+
+    await db.idempotency_keys.update_one(
+        {"key": scoped_key, "reservation": reservation},
+        {"$set": {"response": response}, "$unset": {"reserved_until": ""}}
+    )
+    idempotency_cache.set(scoped_key, response)
+    return response
+
+async def raise_alert(teen: dict, alert_type: str, message: str, notification: dict) -> Alert:
+    """Store an alert, count it as unread on the teen's state and notify the parent."""
+    alert = Alert(
+        parent_id=teen["parent_id"],
+        teen_id=teen["id"],
+        type=alert_type,
+        message=message
+    )
+    await db.alerts.insert_one(alert.dict())
+    await db.teen_state.update_one(
+        {"teen_id": teen["id"]},
+        {"$inc": {"unread_alerts": 1}, "$setOnInsert": {"parent_id": teen["parent_id"]}},
+        upsert=True
+    )
+    await manager.send_personal_message(notification, teen["parent_id"])
+    return alert
+
+# Materialized latest state per teen
+async def update_teen_location_state(teen: dict, location: Location) -> Optional[dict]:
+    """Materialize the fix as the teen's latest and return the state it replaced.
+
+    Returns None for a fix older than the stored one, or for a teen without state.
+    """
+    # Only move forward in time, so a delayed write can never replace a newer fix
+    try:
+        return await db.teen_state.find_one_and_update(
+            {
+                "teen_id": teen["id"],
+                "$or": [{"last_fix_at": {"$lt": location.timestamp}}, {"last_fix_at": {"$exists": False}}]
+            },
+            {
+                "$set": {"last_location": location.dict(), "last_fix_at": location.timestamp},
+                "$setOnInsert": {"parent_id": teen["parent_id"]}
+            },
+            projection={"_id": 0, "last_location": 1, "watched_until": 1},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        return None  # a newer fix is already materialized
+
+async def seed_teen_state(teen: dict) -> dict:
+    """Build the state document for a teen that predates ``teen_state``."""
+    location = await db.locations.find_one({"teen_id": teen["id"]}, {"_id": 0}, sort=[("timestamp", -1)])
+    today = teen_local_date(teen)
+    daily = await db.screen_time_daily.find_one({"teen_id": teen["id"], "date": today})
+    unread = await db.alerts.count_documents({"teen_id": teen["id"], "parent_id": teen["parent_id"], "is_read": False})
+    state = {
+        "teen_id": teen["id"],
+        "parent_id": teen["parent_id"],
+        "last_location": location,
+        "last_fix_at": location["timestamp"] if location else None,
+        "screen_time_today": {"date": today, "minutes": daily["total"] if daily else 0},
+        "unread_alerts": unread,
+        "seeded": True
+    }
+    await db.teen_state.update_one({"teen_id": teen["id"]}, {"$set": state}, upsert=True)
+    return state
+
+EARTH_RADIUS_M = 6371000
+
+def haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance in meters."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+# Offline reverse geocoding
+GAZETTEER_FILE = Path(os.environ.get("GAZETTEER_FILE", ROOT_DIR / "gazetteer.csv"))
+GAZETTEER_CELL_DEGREES = 1.0
+GAZETTEER_MAX_DISTANCE_M = 50000
+GEOCODE_CACHE_SIZE = 50000
+GEOCODE_CACHE_PRECISION = 3  # decimal places, ~110 m
+
+class Gazetteer:
+    """Nearest-place lookup over a local gazetteer.
+
+    Places are bucketed into fixed lat/lon grid cells, so a lookup only compares
+    against the 3x3 block of cells around the point. Results are memoized per
+    coordinate rounded to ``GEOCODE_CACHE_PRECISION`` decimals.
+    """
+
+    def __init__(self, places: List[Dict[str, Any]]):
+        self.cells: Dict[tuple, List[Dict[str, Any]]] = {}
+        for place in places:
+            self.cells.setdefault(self.cell(place["latitude"], place["longitude"]), []).append(place)
+        self.lookup = lru_cache(maxsize=GEOCODE_CACHE_SIZE)(self._lookup)
+
+    @classmethod
+    def from_file(cls, path: Path) -> "Gazetteer":
+        if not path.exists():
+            logging.getLogger(__name__).warning("Gazetteer %s not found, reverse geocoding disabled", path)
+            return cls([])
+        with open(path, newline="") as f:
+            places = [
+                {
+                    "address": ", ".join(part for part in (row["name"], row.get("admin1"), row.get("country_code")) if part),
+                    "latitude": float(row["latitude"]),
+                    "longitude": float(row["longitude"])
+                }
+                for row in csv.DictReader(f)
+            ]
+        return cls(places)
+
+    @staticmethod
+    def cell(latitude: float, longitude: float) -> tuple:
+        return (math.floor(latitude / GAZETTEER_CELL_DEGREES), math.floor(longitude / GAZETTEER_CELL_DEGREES))
+
+    def _lookup(self, latitude: float, longitude: float) -> Optional[str]:
+        lat_cell, lon_cell = self.cell(latitude, longitude)
+        best, best_distance = None, GAZETTEER_MAX_DISTANCE_M
+        for dlat in (-1, 0, 1):
+            for dlon in (-1, 0, 1):
+                for place in self.cells.get((lat_cell + dlat, lon_cell + dlon), ()):
+                    distance = haversine_m(latitude, longitude, place["latitude"], place["longitude"])
+                    if distance <= best_distance:
+                        best, best_distance = place["address"], distance
+        return best
+
+    def reverse(self, latitude: float, longitude: float) -> Optional[str]:
+        return self.lookup(round(latitude, GEOCODE_CACHE_PRECISION), round(longitude, GEOCODE_CACHE_PRECISION))
+
+gazetteer = Gazetteer([])  # loaded from GAZETTEER_FILE by the app lifespan
+
+async def reverse_geocode(latitude: float, longitude: float) -> Optional[str]:
+    # Run off the event loop so large gazetteers never stall ingest
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, gazetteer.reverse, latitude, longitude)
+
+async def get_ingest_teen(teen_id: str) -> Optional[dict]:
+    teen = teen_cache.get(teen_id)
+    if teen is None:
+        teen = await db.teens.find_one({"id": teen_id}, {"_id": 0})
+        if teen:
+            teen_cache.set(teen_id, teen)
+    return teen
+
+async def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN or not hmac.compare_digest(x_admin_token or "", ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Admin access required")
+
 # Parent Authentication Endpoints
 @api_router.post("/auth/register")
 async def register_parent(parent_data: ParentCreate):
@@ -251,10 +724,19 @@ async def create_teen(teen_data: TeenCreate, parent_id: str = Depends(get_curren
         parent_id=parent_id,
         device_id=teen_data.device_id,
         phone_number=teen_data.phone_number,
-        age=teen_data.age
+        age=teen_data.age,
+        timezone=teen_data.timezone
     )
     
     await db.teens.insert_one(teen.dict())
+    await db.teen_state.insert_one({
+        "teen_id": teen.id,
+        "parent_id": parent_id,
+        "last_location": None,
+        "screen_time_today": {"date": teen_local_date(teen.dict()), "minutes": 0},
+        "unread_alerts": 0,
+        "seeded": True
+    })
     return teen
 
 @api_router.get("/teens", response_model=List[Teen])
@@ -262,6 +744,35 @@ async def get_teens(parent_id: str = Depends(get_current_parent)):
     teens = await db.teens.find({"parent_id": parent_id}).to_list(100)
     return [Teen(**teen) for teen in teens]
 
+async def get_teen_states(parent_id: str, teens: List[dict]) -> Dict[str, dict]:
+    states = {
+        state["teen_id"]: state
+        for state in await db.teen_state.find({"parent_id": parent_id}, {"_id": 0}).to_list(100)
+    }
+    for teen in teens:
+        state = states.get(teen["id"])
+        if not state or not state.get("seeded"):
+            states[teen["id"]] = await seed_teen_state(teen)
+    return states
+
+@api_router.get("/teens/overview")
+async def get_teens_overview(parent_id: str = Depends(get_current_parent)):
+    """Live state of every child of the parent from the materialized ``teen_state``."""
+    teens = await db.teens.find({"parent_id": parent_id}).to_list(100)
+    states = await get_teen_states(parent_id, teens)
+    
+    overview = []
+    for teen in teens:
+        state = states[teen["id"]]
+        screen_time = state.get("screen_time_today") or {}
+        overview.append({
+            "teen": Teen(**teen),
+            "last_location": Location(**state["last_location"]) if state.get("last_location") else None,
+            "screen_time_today": screen_time.get("minutes", 0) if screen_time.get("date") == teen_local_date(teen) else 0,
+            "unread_alerts": state.get("unread_alerts", 0)
+        })
+    return overview
+
 @api_router.get("/teens/{teen_id}", response_model=Teen)
 async def get_teen(teen_id: str, parent_id: str = Depends(get_current_parent)):
     teen = await db.teens.find_one({"id": teen_id, "parent_id": parent_id})
@@ -269,47 +780,363 @@ async def get_teen(teen_id: str, parent_id: str = Depends(get_current_parent)):
         raise HTTPException(status_code=404, detail="Teen not found")
     return Teen(**teen)
 
+@api_router.put("/teens/{teen_id}/screen-time-limits", response_model=Teen)
+async def update_screen_time_limits(teen_id: str, limits: Dict[str, int], parent_id: str = Depends(get_current_parent)):
+    teen = await db.teens.find_one_and_update(
+        {"id": teen_id, "parent_id": parent_id},
+        {"$set": {"screen_time_limits": limits}},
+        return_document=ReturnDocument.AFTER
+    )
+    if not teen:
+        raise HTTPException(status_code=404, detail="Teen not found")
+    teen_cache.invalidate(teen_id)
+    return Teen(**teen)
+
+@api_router.put("/teens/{teen_id}/timezone", response_model=Teen)
+async def update_teen_timezone(teen_id: str, update: TimezoneUpdate, parent_id: str = Depends(get_current_parent)):
+    try:
+        ZoneInfo(update.timezone)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise HTTPException(status_code=400, detail="Unknown timezone")
+    teen = await db.teens.find_one_and_update(
+        {"id": teen_id, "parent_id": parent_id},
+        {"$set": {"timezone": update.timezone}},
+        return_document=ReturnDocument.AFTER
+    )
+    if not teen:
+        raise HTTPException(status_code=404, detail="Teen not found")
+    teen_cache.invalidate(teen_id)
+    return Teen(**teen)
+
+# Stay point detection
+STAY_RADIUS_M = 100
+STAY_MIN_DURATION = timedelta(minutes=10)
+FREQUENT_PLACE_RADIUS_M = 150
+
+class StayPointDetector:
+    """Online stay-point detection over each teen's stream of location fixes.
+
+    Per teen it only keeps the open candidate stay (running centroid, arrival and
+    last-seen time). When a fix lands outside ``STAY_RADIUS_M`` of the centroid and
+    the candidate lasted at least ``STAY_MIN_DURATION``, it is written to ``visits``.
+    The candidate lives on ``teen_state`` so it survives restarts and is shared by
+    workers; each update is a compare-and-set on its ``seq``, and a worker whose
+    copy is stale reloads it and tries again.
+    """
+
+    def __init__(self, attempts: int = 3):
+        self.attempts = attempts
+        self.candidates: Dict[str, Optional[Dict[str, Any]]] = {}  # teen_id -> last known candidate
+
+    async def add_fix(self, location: Location):
+        teen_id = location.teen_id
+        for attempt in range(self.attempts):
+            if teen_id not in self.candidates:
+                state = await db.teen_state.find_one({"teen_id": teen_id}, {"stay_candidate": 1})
+                self.candidates[teen_id] = state.get("stay_candidate") if state else None
+            candidate = self.candidates[teen_id]
+            if candidate and location.timestamp <= candidate["last_seen"]:
+                return  # late fix; the stay has already moved past it
+            
+            updated, closed = self.advance(candidate, location)
+            result = await db.teen_state.update_one(
+                {"teen_id": teen_id, "stay_candidate.seq": candidate["seq"] if candidate else None},
+                {"$set": {"stay_candidate": updated}}
+            )
+            if result.matched_count:
+                self.candidates[teen_id] = updated
+                if closed:
+                    await self.emit(teen_id, closed)
+                return
+            self.candidates.pop(teen_id, None)  # another worker moved it on; reload
+
+    def advance(self, candidate: Optional[Dict[str, Any]], location: Location) -> tuple:
+        """Return the next candidate and the stay it closes, if any."""
+        if candidate:
+            latitude = candidate["lat_sum"] / candidate["count"]
+            longitude = candidate["lon_sum"] / candidate["count"]
+            if haversine_m(latitude, longitude, location.latitude, location.longitude) <= STAY_RADIUS_M:
+                return {
+                    **candidate,
+                    "lat_sum": candidate["lat_sum"] + location.latitude,
+                    "lon_sum": candidate["lon_sum"] + location.longitude,
+                    "count": candidate["count"] + 1,
+                    "last_seen": location.timestamp,
+                    "seq": candidate["seq"] + 1
+                }, None
+        
+        closed = None
+        if candidate and candidate["last_seen"] - candidate["arrived_at"] >= STAY_MIN_DURATION:
+            closed = candidate
+        return {
+            "lat_sum": location.latitude,
+            "lon_sum": location.longitude,
+            "count": 1,
+            "arrived_at": location.timestamp,
+            "last_seen": location.timestamp,
+            "seq": candidate["seq"] + 1 if candidate else 1
+        }, closed
+
+    async def emit(self, teen_id: str, candidate: Dict[str, Any]):
+        latitude = candidate["lat_sum"] / candidate["count"]
+        longitude = candidate["lon_sum"] / candidate["count"]
+        visit = Visit(
+            teen_id=teen_id,
+            latitude=latitude,
+            longitude=longitude,
+            address=await reverse_geocode(latitude, longitude),
+            arrived_at=candidate["arrived_at"],
+            left_at=candidate["last_seen"],
+            dwell_minutes=round((candidate["last_seen"] - candidate["arrived_at"]).total_seconds() / 60, 1)
+        )
+        await db.visits.insert_one(visit.dict())
+
+stay_point_detector = StayPointDetector()
+
+# Adaptive location sampling
+SAMPLING_STATIONARY_SPEED_MPS = 0.5
+SAMPLING_WALKING_SPEED_MPS = 1.5  # assumed worst case when stationary near a fence
+SAMPLING_MIN_INTERVAL_SECONDS = 10
+SAMPLING_MAX_INTERVAL_SECONDS = 300
+SAMPLING_LIVE_INTERVAL_SECONDS = 15
+SAMPLING_TARGET_TRAVEL_M = 200
+
+class SamplingAdvisor:
+    """Recommends when a teen's device should report its next location fix.
+
+    Slow down stationary devices, speed up moving ones, and tighten both interval
+    and displacement when the teen nears a geofence boundary or a parent is
+    watching live, so fewer fixes are sent without missing fence crossings. The
+    previous fix and the live-watch flag come from the shared ``teen_state``, so
+    every worker advises the same way.
+    """
+
+    def speed(self, location: Location, previous: Optional[dict]) -> float:
+        if not previous:
+            return 0.0
+        elapsed = (location.timestamp - previous["timestamp"]).total_seconds()
+        if elapsed <= 0:
+            return 0.0
+        return haversine_m(previous["latitude"], previous["longitude"], location.latitude, location.longitude) / elapsed
+
+    def advise(self, location: Location, previous: Optional[dict], boundary_distance: Optional[float], watched: bool) -> Dict[str, int]:
+        speed = self.speed(location, previous)
+        if speed < SAMPLING_STATIONARY_SPEED_MPS:
+            interval, displacement = SAMPLING_MAX_INTERVAL_SECONDS, 50.0
+        elif speed < 3:
+            interval, displacement = 60, 25.0
+        else:
+            interval, displacement = SAMPLING_TARGET_TRAVEL_M / speed, 50.0
+        
+        if boundary_distance is not None:
+            # Report at least twice before the teen could reach the nearest fence edge
+            time_to_boundary = boundary_distance / max(speed, SAMPLING_WALKING_SPEED_MPS)
+            interval = min(interval, time_to_boundary / 2)
+            displacement = min(displacement, boundary_distance / 2)
+        
+        if watched:
+            interval = min(interval, SAMPLING_LIVE_INTERVAL_SECONDS)
+            displacement = min(displacement, 10.0)
+        
+        return {
+            "next_report_seconds": int(max(SAMPLING_MIN_INTERVAL_SECONDS, min(interval, SAMPLING_MAX_INTERVAL_SECONDS))),
+            "min_displacement_m": int(max(5, displacement))
+        }
+
+sampling_advisor = SamplingAdvisor()
+
+# Family geofence evaluation
+GEOFENCE_CELL_DEGREES = 0.01  # ~1.1 km
+GEOFENCE_MAX_INDEXED_CELLS = 25  # bigger fences are checked directly on every fix
+GEOFENCE_BATCH_WINDOW_SECONDS = 0.005
+METERS_PER_DEGREE = 111320
+
+def teen_geofence_query(teen_id: str) -> dict:
+    # Family geofences list their teens; older geofences carry a single teen_id
+    return {"$or": [{"teen_ids": teen_id}, {"teen_id": teen_id}]}
+
+class GeofenceIndex:
+    """Grid index over all of one parent's geofences, shared by their teens.
+
+    Each geofence is bucketed into every grid cell its bounding box touches, so
+    a fix only measures distances to geofences in the 3x3 cells around it. Fences
+    spanning more than ``GEOFENCE_MAX_INDEXED_CELLS`` cells are kept in a short
+    list checked on every fix instead, so building the index stays cheap.
+    """
+
+    def __init__(self, geofences: List[dict]):
+        self.geofences = [Geofence(**geofence) for geofence in geofences]
+        self.cells: Dict[tuple, List[Geofence]] = {}
+        self.large: List[Geofence] = []
+        for geofence in self.geofences:
+            dlat = geofence.radius / METERS_PER_DEGREE
+            dlon = geofence.radius / (METERS_PER_DEGREE * max(math.cos(math.radians(geofence.latitude)), 0.01))
+            lat_min, lon_min = self.cell(geofence.latitude - dlat, geofence.longitude - dlon)
+            lat_max, lon_max = self.cell(geofence.latitude + dlat, geofence.longitude + dlon)
+            if (lat_max - lat_min + 1) * (lon_max - lon_min + 1) > GEOFENCE_MAX_INDEXED_CELLS:
+                self.large.append(geofence)
+                continue
+            for lat_cell in range(lat_min, lat_max + 1):
+                for lon_cell in range(lon_min, lon_max + 1):
+                    self.cells.setdefault((lat_cell, lon_cell), []).append(geofence)
+
+    @staticmethod
+    def cell(latitude: float, longitude: float) -> tuple:
+        return (math.floor(latitude / GEOFENCE_CELL_DEGREES), math.floor(longitude / GEOFENCE_CELL_DEGREES))
+
+    def candidates(self, latitude: float, longitude: float) -> List[Geofence]:
+        lat_cell, lon_cell = self.cell(latitude, longitude)
+        found: Dict[str, Geofence] = {geofence.id: geofence for geofence in self.large}
+        for dlat in (-1, 0, 1):
+            for dlon in (-1, 0, 1):
+                for geofence in self.cells.get((lat_cell + dlat, lon_cell + dlon), ()):
+                    found[geofence.id] = geofence
+        return list(found.values())
+
+    def evaluate_batch(self, fixes: List[tuple]) -> List[tuple]:
+        """For each ``(teen_id, latitude, longitude)`` return ``(entered, boundary_distance)``.
+
+        Fixes from the same area share one candidate lookup.
+        """
+        candidates_by_cell: Dict[tuple, List[Geofence]] = {}
+        results = []
+        for teen_id, latitude, longitude in fixes:
+            cell = self.cell(latitude, longitude)
+            if cell not in candidates_by_cell:
+                candidates_by_cell[cell] = self.candidates(latitude, longitude)
+            
+            entered: List[Geofence] = []
+            boundary_distance = None
+            for geofence in candidates_by_cell[cell]:
+                if teen_id not in geofence.teen_ids and geofence.teen_id != teen_id:
+                    continue
+                distance = haversine_m(latitude, longitude, geofence.latitude, geofence.longitude)
+                edge = abs(distance - geofence.radius)
+                if boundary_distance is None or edge < boundary_distance:
+                    boundary_distance = edge
+                if distance <= geofence.radius:
+                    entered.append(geofence)
+            results.append((entered, boundary_distance))
+        return results
+
+async def load_geofence_index(parent_id: str) -> GeofenceIndex:
+    teen_ids = [teen["id"] for teen in await db.teens.find({"parent_id": parent_id}, {"id": 1}).to_list(100)]
+    geofences = await db.geofences.find(
+        {"$or": [{"parent_id": parent_id}, {"teen_id": {"$in": teen_ids}}]}, {"_id": 0}
+    ).to_list(1000)
+    return GeofenceIndex(geofences)
+
+async def get_geofence_index(parent_id: str) -> GeofenceIndex:
+    index = geofence_cache.get(parent_id)
+    if index is None:
+        index = await load_geofence_index(parent_id)
+        geofence_cache.set(parent_id, index)
+    return index
+
+class GeofenceBatcher:
+    """Evaluates fixes from one family's teens together.
+
+    A fix is evaluated straight away unless another fix from the same family is
+    still being evaluated; then it waits ``GEOFENCE_BATCH_WINDOW_SECONDS`` so
+    the fixes arriving meanwhile are checked in one pass over the shared index.
+    """
+
+    def __init__(self):
+        self.pending: Dict[str, List[tuple]] = {}
+        self.in_flight: Dict[str, int] = {}
+        self.tasks: set = set()
+
+    async def evaluate(self, teen: dict, location: Location) -> tuple:
+        parent_id = teen["parent_id"]
+        future = asyncio.get_running_loop().create_future()
+        batch = self.pending.setdefault(parent_id, [])
+        batch.append((teen["id"], location.latitude, location.longitude, future))
+        if len(batch) == 1:
+            delay = GEOFENCE_BATCH_WINDOW_SECONDS if self.in_flight.get(parent_id) else 0
+            task = asyncio.create_task(self.flush(parent_id, delay))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        return await future
+
+    async def flush(self, parent_id: str, delay: float):
+        if delay:
+            await asyncio.sleep(delay)
+        batch = self.pending.pop(parent_id, [])
+        self.in_flight[parent_id] = self.in_flight.get(parent_id, 0) + 1
+        try:
+            index = await get_geofence_index(parent_id)
+            results = index.evaluate_batch([fix[:3] for fix in batch])
+        except Exception as e:
+            for fix in batch:
+                if not fix[3].done():
+                    fix[3].set_exception(e)
+            return
+        finally:
+            self.in_flight[parent_id] -= 1
+            if not self.in_flight[parent_id]:
+                del self.in_flight[parent_id]
+        for fix, result in zip(batch, results):
+            if not fix[3].done():
+                fix[3].set_result(result)
+
+geofence_batcher = GeofenceBatcher()
+
 # Location Tracking Endpoints
 @api_router.post("/locations")
-async def create_location(location_data: LocationCreate):
+async def create_location(location_data: LocationCreate, idempotency_key: Optional[str] = Header(None)):
+    return await run_idempotent(
+        "locations",
+        location_data.teen_id,
+        idempotency_key or location_data.event_id,
+        lambda: ingest_location(location_data)
+    )
+
+async def ingest_location(location_data: LocationCreate) -> dict:
     # Verify teen exists
-    teen = await db.teens.find_one({"id": location_data.teen_id})
+    teen = await get_ingest_teen(location_data.teen_id)
     if not teen:
         raise HTTPException(status_code=404, detail="Teen not found")
     
-    location = Location(**location_data.dict())
+    location = Location(**location_data.dict(exclude={"event_id", "timestamp"}))
+    if location_data.timestamp:
+        # Device clocks can run ahead; never accept a fix from the future
+        fixed_at = location_data.timestamp
+        if fixed_at.tzinfo:
+            fixed_at = fixed_at.astimezone(ZoneInfo("UTC")).replace(tzinfo=None)
+        location.timestamp = min(fixed_at, location.timestamp)
+    if not location.address:
+        location.address = await reverse_geocode(location.latitude, location.longitude)
     await db.locations.insert_one(location.dict())
+    previous_state = await update_teen_location_state(teen, location) or {}
+    await stay_point_detector.add_fix(location)
     
-    # Check geofences
-    geofences = await db.geofences.find({"teen_id": location_data.teen_id}).to_list(100)
-    for geofence_data in geofences:
-        geofence = Geofence(**geofence_data)
-        # Simple distance calculation (you might want to use a proper geospatial library)
-        distance = ((location.latitude - geofence.latitude) ** 2 + 
-                   (location.longitude - geofence.longitude) ** 2) ** 0.5 * 111000  # rough meters
-        
-        if distance <= geofence.radius:
-            # Create alert
-            alert = Alert(
-                parent_id=teen["parent_id"],
-                teen_id=location_data.teen_id,
-                type="geofence_enter",
-                message=f"{teen['name']} entered {geofence.name}"
-            )
-            await db.alerts.insert_one(alert.dict())
-            
-            # Send real-time notification
-            await manager.send_personal_message(
-                {
-                    "type": "geofence_alert",
-                    "teen_name": teen["name"],
-                    "geofence_name": geofence.name,
-                    "action": "entered"
-                },
-                teen["parent_id"]
-            )
+    # Check geofences against the family's shared index
+    entered, boundary_distance = await geofence_batcher.evaluate(teen, location)
+    for geofence in entered:
+        # Create alert and send real-time notification
+        await raise_alert(
+            teen,
+            "geofence_enter",
+            f"{teen['name']} entered {geofence.name}",
+            {
+                "type": "geofence_alert",
+                "teen_id": teen["id"],
+                "teen_name": teen["name"],
+                "geofence_id": geofence.id,
+                "geofence_name": geofence.name,
+                "geofence_type": geofence.type,
+                "action": "entered"
+            }
+        )
     
-    return {"status": "success", "location_id": location.id}
+    watched_until = previous_state.get("watched_until")
+    sampling = sampling_advisor.advise(
+        location,
+        previous_state.get("last_location"),
+        boundary_distance,
+        bool(watched_until and watched_until > datetime.utcnow())
+    )
+    return {"status": "success", "location_id": location.id, "sampling": sampling}
 
 @api_router.get("/teens/{teen_id}/locations")
 async def get_teen_locations(teen_id: str, limit: int = 100, parent_id: str = Depends(get_current_parent)):
@@ -318,7 +1145,7 @@ async def get_teen_locations(teen_id: str, limit: int = 100, parent_id: str = De
     if not teen:
         raise HTTPException(status_code=404, detail="Teen not found")
     
-    locations = await db.locations.find({"teen_id": teen_id}).sort("timestamp", -1).limit(limit).to_list(limit)
+    locations = await read_db.locations.find({"teen_id": teen_id}).sort("timestamp", -1).limit(limit).to_list(limit)
     return [Location(**loc) for loc in locations]
 
 @api_router.get("/teens/{teen_id}/current-location")
@@ -328,24 +1155,98 @@ async def get_current_location(teen_id: str, parent_id: str = Depends(get_curren
     if not teen:
         raise HTTPException(status_code=404, detail="Teen not found")
     
-    location = await db.locations.find_one({"teen_id": teen_id}, sort=[("timestamp", -1)])
+    state = await db.teen_state.find_one({"teen_id": teen_id}, {"last_location": 1})
+    location = state.get("last_location") if state else None
+    if not location:
+        location = await db.locations.find_one({"teen_id": teen_id}, sort=[("timestamp", -1)])
     if not location:
         raise HTTPException(status_code=404, detail="No location data found")
     
     return Location(**location)
 
+@api_router.get("/teens/{teen_id}/visits")
+async def get_teen_visits(teen_id: str, limit: int = 100, parent_id: str = Depends(get_current_parent)):
+    # Verify teen belongs to parent
+    teen = await db.teens.find_one({"id": teen_id, "parent_id": parent_id})
+    if not teen:
+        raise HTTPException(status_code=404, detail="Teen not found")
+    
+    visits = await read_db.visits.find({"teen_id": teen_id}).sort("arrived_at", -1).limit(limit).to_list(limit)
+    return [Visit(**visit) for visit in visits]
+
+@api_router.get("/teens/{teen_id}/frequent-places")
+async def get_frequent_places(teen_id: str, days: int = 30, limit: int = 10, parent_id: str = Depends(get_current_parent)):
+    # Verify teen belongs to parent
+    teen = await db.teens.find_one({"id": teen_id, "parent_id": parent_id})
+    if not teen:
+        raise HTTPException(status_code=404, detail="Teen not found")
+    
+    visits = await read_db.visits.find(
+        {"teen_id": teen_id, "arrived_at": {"$gte": datetime.utcnow() - timedelta(days=days)}},
+        {"_id": 0, "latitude": 1, "longitude": 1, "address": 1, "arrived_at": 1, "left_at": 1, "dwell_minutes": 1}
+    ).sort("arrived_at", 1).to_list(10000)
+    
+    # Merge visits to the same spot into places, weighting centroids by dwell time
+    places: List[Dict[str, Any]] = []
+    for visit in visits:
+        weight = max(visit["dwell_minutes"], 1)
+        place = next(
+            (p for p in places
+             if haversine_m(p["latitude"], p["longitude"], visit["latitude"], visit["longitude"]) <= FREQUENT_PLACE_RADIUS_M),
+            None
+        )
+        if place is None:
+            places.append({
+                "latitude": visit["latitude"],
+                "longitude": visit["longitude"],
+                "address": visit.get("address"),
+                "visit_count": 1,
+                "total_dwell_minutes": visit["dwell_minutes"],
+                "last_visit": visit["left_at"],
+                "_weight": weight
+            })
+            continue
+        total = place["_weight"] + weight
+        place["latitude"] = (place["latitude"] * place["_weight"] + visit["latitude"] * weight) / total
+        place["longitude"] = (place["longitude"] * place["_weight"] + visit["longitude"] * weight) / total
+        place["_weight"] = total
+        place["visit_count"] += 1
+        place["total_dwell_minutes"] = round(place["total_dwell_minutes"] + visit["dwell_minutes"], 1)
+        place["last_visit"] = visit["left_at"]
+        place["address"] = place["address"] or visit.get("address")
+    
+    places.sort(key=lambda p: p["total_dwell_minutes"], reverse=True)
+    for place in places:
+        del place["_weight"]
+    return places[:limit]
+
 # Geofencing Endpoints
 @api_router.post("/geofences", response_model=Geofence)
 async def create_geofence(geofence_data: GeofenceCreate, parent_id: str = Depends(get_current_parent)):
-    # Verify teen belongs to parent
-    teen = await db.teens.find_one({"id": geofence_data.teen_id, "parent_id": parent_id})
-    if not teen:
+    teen_ids = list(dict.fromkeys(geofence_data.teen_ids or ([geofence_data.teen_id] if geofence_data.teen_id else [])))
+    if not teen_ids:
+        raise HTTPException(status_code=400, detail="Provide teen_id or teen_ids")
+    
+    # Verify teens belong to parent
+    owned = await db.teens.count_documents({"id": {"$in": teen_ids}, "parent_id": parent_id})
+    if owned != len(teen_ids):
         raise HTTPException(status_code=404, detail="Teen not found")
     
-    geofence = Geofence(**geofence_data.dict())
+    geofence = Geofence(
+        **geofence_data.dict(exclude={"teen_id", "teen_ids"}),
+        teen_id=teen_ids[0] if len(teen_ids) == 1 else None,
+        parent_id=parent_id,
+        teen_ids=teen_ids
+    )
     await db.geofences.insert_one(geofence.dict())
+    geofence_cache.invalidate(parent_id)
     return geofence
 
+@api_router.get("/geofences")
+async def get_family_geofences(parent_id: str = Depends(get_current_parent)):
+    index = await load_geofence_index(parent_id)
+    return index.geofences
+
 @api_router.get("/teens/{teen_id}/geofences")
 async def get_teen_geofences(teen_id: str, parent_id: str = Depends(get_current_parent)):
     # Verify teen belongs to parent
@@ -353,14 +1254,151 @@ async def get_teen_geofences(teen_id: str, parent_id: str = Depends(get_current_
     if not teen:
         raise HTTPException(status_code=404, detail="Teen not found")
     
-    geofences = await db.geofences.find({"teen_id": teen_id}).to_list(100)
+    geofences = await db.geofences.find(teen_geofence_query(teen_id)).to_list(100)
     return [Geofence(**geofence) for geofence in geofences]
 
+# Screen time limit evaluation
+def teen_timezone(teen: dict) -> ZoneInfo:
+    try:
+        return ZoneInfo(teen.get("timezone") or "UTC")
+    except (ZoneInfoNotFoundError, ValueError):
+        return ZoneInfo("UTC")
+
+def teen_local_date(teen: dict) -> str:
+    return datetime.now(teen_timezone(teen)).strftime("%Y-%m-%d")
+
+SCREEN_TIME_ALERT_WINDOW_DAYS = 1  # reports dated further from the teen's local today never alert
+
+class ScreenTimeEvaluator:
+    """Incrementally evaluates screen time limits as app usage is reported.
+
+    Each report is added to the teen's ``screen_time_daily`` total with ``$inc``
+    and checked against the stored total it returns, so reports handled by other
+    workers count too and checking limits never rescans ``app_usage``. Alerts are
+    recorded in the daily document with a conditional ``$addToSet`` so each limit
+    alerts at most once per day.
+    """
+
+    def __init__(self):
+        self.limits: Dict[str, Any] = {}  # teen_id -> (controls_version, {package: minutes})
+
+    async def add_to_total(self, teen_id: str, date: str, delta: int) -> int:
+        daily = await db.screen_time_daily.find_one_and_update(
+            {"teen_id": teen_id, "date": date},
+            {"$inc": {"total": delta}},
+            return_document=ReturnDocument.AFTER
+        )
+        if daily:
+            return daily["total"]
+        # No rollup for this day yet: seed it once from app_usage, which already
+        # includes the report being recorded
+        usage = await db.app_usage.find(
+            {"teen_id": teen_id, "date": date}, {"usage_time": 1}
+        ).to_list(1000)
+        total = sum(u["usage_time"] for u in usage)
+        await db.screen_time_daily.update_one(
+            {"teen_id": teen_id, "date": date},
+            {"$setOnInsert": {"total": total, "alerted": []}},
+            upsert=True
+        )
+        return total
+
+    async def app_limits(self, teen: dict) -> Dict[str, int]:
+        version = teen.get("controls_version", 0)
+        cached = self.limits.get(teen["id"])
+        if cached and cached[0] == version:
+            return cached[1]
+        controls = await db.app_controls.find(
+            {"teen_id": teen["id"], "time_limit": {"$ne": None}, "deleted": {"$ne": True}},
+            {"package_name": 1, "time_limit": 1}
+        ).to_list(1000)
+        limits = {c["package_name"]: c["time_limit"] for c in controls}
+        self.limits[teen["id"]] = (version, limits)
+        return limits
+
+    async def record(self, teen: dict, usage_data: "AppUsageCreate", previous_minutes: int):
+        # The device's own date is the day key, so a teen whose stored timezone is
+        # off still gets alerted; only reports for long-gone days skip alerting
+        teen_id = teen["id"]
+        day = usage_data.date
+        delta = usage_data.usage_time - previous_minutes
+        total = await self.add_to_total(teen_id, day, delta)
+        
+        today = datetime.strptime(teen_local_date(teen), "%Y-%m-%d")
+        if abs((datetime.strptime(day, "%Y-%m-%d") - today).days) > SCREEN_TIME_ALERT_WINDOW_DAYS:
+            return
+        
+        try:
+            await db.teen_state.update_one(
+                {
+                    "teen_id": teen_id,
+                    "$or": [{"screen_time_today.date": {"$lte": day}}, {"screen_time_today": {"$exists": False}}]
+                },
+                {
+                    "$set": {"screen_time_today": {"date": day, "minutes": total}},
+                    "$setOnInsert": {"parent_id": teen["parent_id"]}
+                },
+                upsert=True
+            )
+        except DuplicateKeyError:
+            pass  # the state already shows a later day
+        
+        limits = {name.lower(): minutes for name, minutes in teen.get("screen_time_limits", {}).items()}
+        weekday = datetime.strptime(day, "%Y-%m-%d").strftime("%A").lower()
+        daily_limit = limits.get(weekday, limits.get("default"))
+        if daily_limit is not None and total >= daily_limit:
+            await self.alert(
+                teen, day, "daily",
+                f"{teen['name']} reached the daily screen time limit of {daily_limit} minutes"
+            )
+        
+        app_limit = (await self.app_limits(teen)).get(usage_data.package_name)
+        if app_limit is not None and usage_data.usage_time >= app_limit:
+            await self.alert(
+                teen, day, usage_data.package_name,
+                f"{teen['name']} reached the {usage_data.app_name} time limit of {app_limit} minutes"
+            )
+
+    async def alert(self, teen: dict, date: str, limit_key: str, message: str):
+        result = await db.screen_time_daily.update_one(
+            {"teen_id": teen["id"], "date": date, "alerted": {"$ne": limit_key}},
+            {"$addToSet": {"alerted": limit_key}}
+        )
+        if result.modified_count == 0:
+            return
+        
+        await raise_alert(
+            teen,
+            "screen_time",
+            message,
+            {
+                "type": "screen_time_alert",
+                "teen_name": teen["name"],
+                "message": message
+            }
+        )
+
+screen_time_evaluator = ScreenTimeEvaluator()
+
 # App Usage Endpoints
 @api_router.post("/app-usage")
-async def create_app_usage(usage_data: AppUsageCreate):
+async def create_app_usage(usage_data: AppUsageCreate, idempotency_key: Optional[str] = Header(None)):
+    return await run_idempotent(
+        "app-usage",
+        usage_data.teen_id,
+        idempotency_key or usage_data.event_id,
+        lambda: ingest_app_usage(usage_data)
+    )
+
+async def ingest_app_usage(usage_data: AppUsageCreate) -> dict:
+    # Daily rollups and weekly reports key on the date, so reject bad ones before writing
+    try:
+        datetime.strptime(usage_data.date, "%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="date must look like YYYY-MM-DD")
+    
     # Verify teen exists
-    teen = await db.teens.find_one({"id": usage_data.teen_id})
+    teen = await get_ingest_teen(usage_data.teen_id)
     if not teen:
         raise HTTPException(status_code=404, detail="Teen not found")
     
@@ -377,11 +1415,15 @@ async def create_app_usage(usage_data: AppUsageCreate):
             {"id": existing_usage["id"]},
             {"$set": {"usage_time": usage_data.usage_time, "last_used": datetime.utcnow()}}
         )
+        await screen_time_evaluator.record(teen, usage_data, existing_usage["usage_time"])
+        await invalidate_weekly_report(teen, usage_data.date)
         return {"status": "updated", "usage_id": existing_usage["id"]}
     else:
         # Create new usage record
-        usage = AppUsage(**usage_data.dict())
+        usage = AppUsage(**usage_data.dict(exclude={"event_id"}))
         await db.app_usage.insert_one(usage.dict())
+        await screen_time_evaluator.record(teen, usage_data, 0)
+        await invalidate_weekly_report(teen, usage_data.date)
         return {"status": "created", "usage_id": usage.id}
 
 @api_router.get("/teens/{teen_id}/app-usage")
@@ -395,10 +1437,43 @@ async def get_teen_app_usage(teen_id: str, date: Optional[str] = None, parent_id
     if date:
         query["date"] = date
     
-    usage_data = await db.app_usage.find(query).to_list(1000)
+    usage_data = await read_db.app_usage.find(query).to_list(1000)
     return [AppUsage(**usage) for usage in usage_data]
 
 # App Control Endpoints
+@asynccontextmanager
+async def controls_write(teen_id: str):
+    """Reserve the next controls version for a write made inside the block.
+
+    The reservation stays listed in ``controls_pending`` until the block exits, so
+    a sync never hands out a version whose control has not been written yet.
+    """
+    token = str(uuid.uuid4())
+    teen = await db.teens.find_one_and_update(
+        {"id": teen_id},
+        {"$inc": {"controls_version": 1}, "$push": {"controls_pending": {"token": token, "at": datetime.utcnow()}}},
+        projection={"controls_version": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    try:
+        yield teen["controls_version"]
+    finally:
+        await db.teens.update_one({"id": teen_id}, {"$pull": {"controls_pending": {"token": token}}})
+        teen_cache.invalidate(teen_id)
+        controls_notifier.notify(teen_id)
+
+async def settled_controls_version(teen_id: str) -> Optional[int]:
+    """The teen's controls version once no write is in flight, or None if one stays in flight."""
+    for attempt in range(APP_CONTROLS_SETTLE_ATTEMPTS):
+        teen = await db.teens.find_one({"id": teen_id}, {"controls_version": 1, "controls_pending": 1})
+        if not teen:
+            raise HTTPException(status_code=404, detail="Teen not found")
+        cutoff = datetime.utcnow() - timedelta(seconds=APP_CONTROLS_PENDING_SECONDS)
+        if not any(pending["at"] > cutoff for pending in teen.get("controls_pending", [])):
+            return teen.get("controls_version", 0)
+        await asyncio.sleep(0.05)
+    return None
+
 @api_router.post("/app-controls", response_model=AppControl)
 async def create_app_control(control_data: AppControlCreate, parent_id: str = Depends(get_current_parent)):
     # Verify teen belongs to parent
@@ -412,19 +1487,45 @@ async def create_app_control(control_data: AppControlCreate, parent_id: str = De
         "package_name": control_data.package_name
     })
     
-    if existing_control:
-        # Update existing control
+    async with controls_write(control_data.teen_id) as version:
+        if existing_control:
+            # Update existing control
+            await db.app_controls.update_one(
+                {"id": existing_control["id"]},
+                {"$set": {
+                    **control_data.dict(exclude_unset=True),
+                    "version": version,
+                    "deleted": False,
+                    "updated_at": datetime.utcnow()
+                }}
+            )
+            updated_control = await db.app_controls.find_one({"id": existing_control["id"]})
+            control = AppControl(**updated_control)
+        else:
+            # Create new control
+            control = AppControl(**control_data.dict(), version=version)
+            await db.app_controls.insert_one(control.dict())
+    
+    return control
+
+@api_router.delete("/app-controls/{control_id}")
+async def delete_app_control(control_id: str, parent_id: str = Depends(get_current_parent)):
+    control = await db.app_controls.find_one({"id": control_id, "deleted": {"$ne": True}})
+    if not control:
+        raise HTTPException(status_code=404, detail="App control not found")
+    
+    # Verify teen belongs to parent
+    teen = await db.teens.find_one({"id": control["teen_id"], "parent_id": parent_id})
+    if not teen:
+        raise HTTPException(status_code=404, detail="App control not found")
+    
+    # Keep a tombstone so syncing devices learn about the removal
+    async with controls_write(control["teen_id"]) as version:
         await db.app_controls.update_one(
-            {"id": existing_control["id"]},
-            {"$set": control_data.dict(exclude_unset=True)}
+            {"id": control_id},
+            {"$set": {"deleted": True, "version": version, "updated_at": datetime.utcnow()}}
         )
-        updated_control = await db.app_controls.find_one({"id": existing_control["id"]})
-        return AppControl(**updated_control)
-    else:
-        # Create new control
-        control = AppControl(**control_data.dict())
-        await db.app_controls.insert_one(control.dict())
-        return control
+    return {"status": "success"}
 
 @api_router.get("/teens/{teen_id}/app-controls")
 async def get_teen_app_controls(teen_id: str, parent_id: str = Depends(get_current_parent)):
@@ -433,35 +1534,207 @@ async def get_teen_app_controls(teen_id: str, parent_id: str = Depends(get_curre
     if not teen:
         raise HTTPException(status_code=404, detail="Teen not found")
     
-    controls = await db.app_controls.find({"teen_id": teen_id}).to_list(1000)
+    controls = await db.app_controls.find({"teen_id": teen_id, "deleted": {"$ne": True}}).to_list(1000)
     return [AppControl(**control) for control in controls]
 
+@api_router.get("/teens/{teen_id}/app-controls/sync")
+async def sync_teen_app_controls(teen_id: str, since_version: int = 0, wait: int = 0):
+    """Device-facing delta sync of app controls.
+
+    Returns the controls changed after ``since_version`` plus the ids of deleted
+    ones, or 304 when the device is already up to date. With ``wait`` > 0 the
+    request long-polls for up to that many seconds before answering 304.
+    """
+    version = await settled_controls_version(teen_id)
+    if version is not None and version <= since_version and wait > 0:
+        await controls_notifier.wait(teen_id, min(wait, APP_CONTROLS_MAX_WAIT_SECONDS))
+        # Read again even on timeout: another worker may have changed the controls
+        version = await settled_controls_version(teen_id)
+    
+    if version is None:
+        # A write is still landing; keep the device where it is until it does
+        return Response(status_code=304, headers={"X-Controls-Version": str(since_version)})
+    if version <= since_version:
+        return Response(status_code=304, headers={"X-Controls-Version": str(version)})
+    
+    changed = await db.app_controls.find(
+        {"teen_id": teen_id, "version": {"$gt": since_version, "$lte": version}}
+    ).to_list(1000)
+    
+    return {
+        "version": version,
+        "controls": [AppControl(**control) for control in changed if not control.get("deleted")],
+        "deleted": [control["id"] for control in changed if control.get("deleted")]
+    }
+
+# Web history classification
+DOMAIN_CATEGORIES_FILE = Path(os.environ.get("DOMAIN_CATEGORIES_FILE", ROOT_DIR / "domain_categories.json"))
+TRACKING_PARAM_PREFIXES = ("utm_",)
+TRACKING_PARAMS = {"fbclid", "gclid", "dclid", "msclkid", "igshid", "mc_cid", "mc_eid", "ref", "ref_src"}
+
+def url_host(url: str) -> str:
+    try:
+        return urlsplit(url).hostname or ""
+    except ValueError:
+        return ""
+
+def normalize_url(url: str) -> str:
+    """Canonical form of a visited URL so tracking variants dedupe together.
+
+    URLs that do not parse (bad port, unbalanced IPv6 brackets) are kept as sent.
+    """
+    try:
+        parts = urlsplit(url.strip())
+        if not parts.scheme:
+            parts = urlsplit("http://" + url.strip())
+        port = parts.port
+    except ValueError:
+        return url.strip()
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").rstrip(".")
+    if ":" in host:
+        host = f"[{host}]"  # IPv6 literal
+    netloc = host if port is None or (scheme, port) in (("http", 80), ("https", 443)) else f"{host}:{port}"
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key.lower() not in TRACKING_PARAMS and not key.lower().startswith(TRACKING_PARAM_PREFIXES)
+    )
+    return urlunsplit((scheme, netloc, parts.path or "/", urlencode(query), ""))
+
+class DomainMatcher:
+    """Reversed-label trie mapping hostnames to their most specific listed domain.
+
+    ``m.youtube.com`` walks ``com -> youtube -> m`` and matches the deepest node
+    that ends a listed domain, so lookups cost one dict hit per label.
+    """
+
+    def __init__(self, categories: Dict[str, List[str]]):
+        self.root: Dict[str, Any] = {}
+        for category, domains in categories.items():
+            for domain in domains:
+                node = self.root
+                for label in reversed(domain.lower().strip(".").split(".")):
+                    node = node.setdefault(label, {})
+                node[""] = (domain.lower(), category)  # "" can never be a label
+
+    @classmethod
+    def from_file(cls, path: Path) -> "DomainMatcher":
+        if not path.exists():
+            logging.getLogger(__name__).warning("Domain category list %s not found", path)
+            return cls({})
+        with open(path) as f:
+            return cls(json.load(f).get("categories", {}))
+
+    def match(self, host: str) -> Optional[tuple]:
+        node = self.root
+        found = None
+        for label in reversed(host.split(".")):
+            node = node.get(label)
+            if node is None:
+                break
+            found = node.get("", found)
+        return found
+
+    def classify(self, url: str) -> tuple:
+        """Return ``(domain, category)`` for a normalized URL."""
+        host = url_host(url)
+        matched = self.match(host)
+        if matched:
+            return matched
+        return (host[4:] if host.startswith("www.") else host), None
+
+def load_restricted_categories(path: Path) -> set:
+    if not path.exists():
+        return set()
+    with open(path) as f:
+        return set(json.load(f).get("restricted", []))
+
+# Loaded from DOMAIN_CATEGORIES_FILE by the app lifespan
+domain_matcher = DomainMatcher({})
+restricted_categories: set = set()
+
+async def alert_restricted_site(teen: dict, domain: str, category: str):
+    # At most one alert per restricted domain per teen per day
+    today = teen_local_date(teen)
+    result = await db.web_domain_stats.update_one(
+        {"teen_id": teen["id"], "domain": domain, "last_alert_date": {"$ne": today}},
+        {"$set": {"last_alert_date": today}}
+    )
+    if result.modified_count == 0:
+        return
+    
+    await raise_alert(
+        teen,
+        "restricted_site",
+        f"{teen['name']} visited {domain} ({category})",
+        {
+            "type": "restricted_site_alert",
+            "teen_name": teen["name"],
+            "domain": domain,
+            "category": category
+        }
+    )
+
 # Web History Endpoints
 @api_router.post("/web-history")
-async def create_web_history(history_data: WebHistoryCreate):
+async def create_web_history(history_data: WebHistoryCreate, idempotency_key: Optional[str] = Header(None)):
+    return await run_idempotent(
+        "web-history",
+        history_data.teen_id,
+        idempotency_key or history_data.event_id,
+        lambda: ingest_web_history(history_data)
+    )
+
+async def ingest_web_history(history_data: WebHistoryCreate) -> dict:
     # Verify teen exists
-    teen = await db.teens.find_one({"id": history_data.teen_id})
+    teen = await get_ingest_teen(history_data.teen_id)
     if not teen:
         raise HTTPException(status_code=404, detail="Teen not found")
     
+    url = normalize_url(history_data.url)
+    domain, category = domain_matcher.classify(url)
+    now = datetime.utcnow()
+    
+    # Per-domain counters back top-sites and restricted-site checks; the per-day
+    # ones back weekly reports, since web_history only keeps lifetime counts per URL
+    await asyncio.gather(
+        db.web_domain_stats.update_one(
+            {"teen_id": history_data.teen_id, "domain": domain},
+            {"$inc": {"visit_count": 1}, "$set": {"category": category, "last_visit": now}},
+            upsert=True
+        ),
+        db.web_domain_daily.update_one(
+            {"teen_id": history_data.teen_id, "date": teen_local_date(teen), "domain": domain},
+            {"$inc": {"visits": 1}, "$set": {"category": category}},
+            upsert=True
+        )
+    )
+    if category in restricted_categories:
+        await alert_restricted_site(teen, domain, category)
+    
     # Check if URL already exists for today
     existing_history = await db.web_history.find_one({
         "teen_id": history_data.teen_id,
-        "url": history_data.url
+        "url": url
     })
     
     if existing_history:
         # Update visit count
         await db.web_history.update_one(
             {"id": existing_history["id"]},
-            {"$inc": {"visit_count": 1}, "$set": {"timestamp": datetime.utcnow()}}
+            {"$inc": {"visit_count": 1}, "$set": {"timestamp": now}}
         )
-        return {"status": "updated", "history_id": existing_history["id"]}
+        return {"status": "updated", "history_id": existing_history["id"], "domain": domain, "category": category}
     else:
         # Create new history record
-        history = WebHistory(**history_data.dict())
+        history = WebHistory(
+            **history_data.dict(exclude={"event_id", "url"}),
+            url=url,
+            domain=domain,
+            category=category
+        )
         await db.web_history.insert_one(history.dict())
-        return {"status": "created", "history_id": history.id}
+        return {"status": "created", "history_id": history.id, "domain": domain, "category": category}
 
 @api_router.get("/teens/{teen_id}/web-history")
 async def get_teen_web_history(teen_id: str, limit: int = 100, parent_id: str = Depends(get_current_parent)):
@@ -470,9 +1743,23 @@ async def get_teen_web_history(teen_id: str, limit: int = 100, parent_id: str =
     if not teen:
         raise HTTPException(status_code=404, detail="Teen not found")
     
-    history = await db.web_history.find({"teen_id": teen_id}).sort("timestamp", -1).limit(limit).to_list(limit)
+    history = await read_db.web_history.find({"teen_id": teen_id}).sort("timestamp", -1).limit(limit).to_list(limit)
     return [WebHistory(**hist) for hist in history]
 
+@api_router.get("/teens/{teen_id}/top-sites")
+async def get_teen_top_sites(teen_id: str, limit: int = 10, category: Optional[str] = None, parent_id: str = Depends(get_current_parent)):
+    # Verify teen belongs to parent
+    teen = await db.teens.find_one({"id": teen_id, "parent_id": parent_id})
+    if not teen:
+        raise HTTPException(status_code=404, detail="Teen not found")
+    
+    query = {"teen_id": teen_id}
+    if category:
+        query["category"] = category
+    
+    sites = await read_db.web_domain_stats.find(query, {"_id": 0, "teen_id": 0, "last_alert_date": 0}).sort("visit_count", -1).limit(limit).to_list(limit)
+    return sites
+
 # Alerts Endpoints
 @api_router.get("/alerts")
 async def get_alerts(parent_id: str = Depends(get_current_parent), unread_only: bool = False):
@@ -483,14 +1770,54 @@ async def get_alerts(parent_id: str = Depends(get_current_parent), unread_only:
     alerts = await db.alerts.find(query).sort("created_at", -1).to_list(100)
     return [Alert(**alert) for alert in alerts]
 
+@api_router.get("/alerts/count")
+async def get_unread_alert_count(parent_id: str = Depends(get_current_parent)):
+    """Unread alert badge counts, read from the per-teen counters in ``teen_state``."""
+    teens = await db.teens.find({"parent_id": parent_id}, {"id": 1, "parent_id": 1, "timezone": 1}).to_list(100)
+    states = await get_teen_states(parent_id, teens)
+    teen_counts = {teen["id"]: max(states[teen["id"]].get("unread_alerts", 0), 0) for teen in teens}
+    return {"unread": sum(teen_counts.values()), "teens": teen_counts}
+
+async def decrement_unread_counts(batch_id: str):
+    # Count exactly the alerts this batch flipped, per teen
+    counts = await db.alerts.aggregate([
+        {"$match": {"read_batch": batch_id}},
+        {"$group": {"_id": "$teen_id", "count": {"$sum": 1}}}
+    ]).to_list(100)
+    for count in counts:
+        await db.teen_state.update_one({"teen_id": count["_id"]}, {"$inc": {"unread_alerts": -count["count"]}})
+    return sum(count["count"] for count in counts)
+
+@api_router.put("/alerts/read")
+async def mark_alerts_read(request: AlertsMarkRead, parent_id: str = Depends(get_current_parent)):
+    """Mark many alerts read at once, by id list and/or everything up to a timestamp."""
+    if request.alert_ids is None and request.up_to is None:
+        raise HTTPException(status_code=400, detail="Provide alert_ids or up_to")
+    
+    query: Dict[str, Any] = {"parent_id": parent_id, "is_read": False}
+    if request.alert_ids is not None:
+        query["id"] = {"$in": request.alert_ids}
+    if request.up_to is not None:
+        query["created_at"] = {"$lte": request.up_to}
+    if request.teen_id:
+        query["teen_id"] = request.teen_id
+    
+    batch_id = str(uuid.uuid4())
+    result = await db.alerts.update_many(query, {"$set": {"is_read": True, "read_batch": batch_id}})
+    if result.modified_count:
+        await decrement_unread_counts(batch_id)
+    return {"status": "success", "updated": result.modified_count}
+
 @api_router.put("/alerts/{alert_id}/read")
 async def mark_alert_read(alert_id: str, parent_id: str = Depends(get_current_parent)):
-    result = await db.alerts.update_one(
-        {"id": alert_id, "parent_id": parent_id},
-        {"$set": {"is_read": True}}
+    alert = await db.alerts.find_one_and_update(
+        {"id": alert_id, "parent_id": parent_id, "is_read": False},
+        {"$set": {"is_read": True}},
+        projection={"teen_id": 1}
     )
-    if result.modified_count == 0:
+    if not alert:
         raise HTTPException(status_code=404, detail="Alert not found")
+    await db.teen_state.update_one({"teen_id": alert["teen_id"]}, {"$inc": {"unread_alerts": -1}})
     return {"status": "success"}
 
 # Dashboard Analytics
@@ -504,20 +1831,25 @@ async def get_dashboard_data(teen_id: str, parent_id: str = Depends(get_current_
     today = datetime.now().strftime("%Y-%m-%d")
     
     # Get today's app usage
-    app_usage = await db.app_usage.find({"teen_id": teen_id, "date": today}).to_list(1000)
+    app_usage = await read_db.app_usage.find({"teen_id": teen_id, "date": today}).to_list(1000)
     total_screen_time = sum(usage["usage_time"] for usage in app_usage)
     
     # Get recent locations
-    recent_locations = await db.locations.find({"teen_id": teen_id}).sort("timestamp", -1).limit(10).to_list(10)
+    recent_locations = await read_db.locations.find({"teen_id": teen_id}).sort("timestamp", -1).limit(10).to_list(10)
     
     # Get recent web history
-    recent_web_history = await db.web_history.find({"teen_id": teen_id}).sort("timestamp", -1).limit(20).to_list(20)
+    recent_web_history = await read_db.web_history.find({"teen_id": teen_id}).sort("timestamp", -1).limit(20).to_list(20)
     
     # Get active geofences
-    geofences = await db.geofences.find({"teen_id": teen_id}).to_list(100)
+    geofences = await db.geofences.find(teen_geofence_query(teen_id)).to_list(100)
     
-    # Get unread alerts
-    unread_alerts = await db.alerts.find({"parent_id": parent_id, "teen_id": teen_id, "is_read": False}).to_list(100)
+    # Get the most recent unread alerts; the total comes from the maintained counter
+    unread_alerts = await db.alerts.find(
+        {"parent_id": parent_id, "teen_id": teen_id, "is_read": False}
+    ).sort("created_at", -1).limit(20).to_list(20)
+    state = await db.teen_state.find_one({"teen_id": teen_id}, {"unread_alerts": 1, "seeded": 1})
+    if not state or not state.get("seeded"):
+        state = await seed_teen_state(teen)
     
     return {
         "teen": Teen(**teen),
@@ -526,30 +1858,565 @@ async def get_dashboard_data(teen_id: str, parent_id: str = Depends(get_current_
         "recent_locations": [Location(**loc) for loc in recent_locations],
         "recent_web_history": [WebHistory(**hist) for hist in recent_web_history],
         "geofences": [Geofence(**geofence) for geofence in geofences],
-        "unread_alerts": [Alert(**alert) for alert in unread_alerts]
+        "unread_alerts": [Alert(**alert) for alert in unread_alerts],
+        "unread_alert_count": max(state.get("unread_alerts", 0), 0)
+    }
+
+# Weekly activity reports
+REPORT_WORKERS = int(os.environ.get("REPORT_WORKERS", "2"))
+REPORT_CURRENT_WEEK_TTL = timedelta(minutes=15)
+REPORT_TOP_N = 10
+
+report_executor: Optional[ProcessPoolExecutor] = None
+
+def get_report_executor() -> ProcessPoolExecutor:
+    global report_executor
+    if report_executor is None:
+        report_executor = ProcessPoolExecutor(max_workers=REPORT_WORKERS)
+    return report_executor
+
+def iso_week(date: str) -> str:
+    year, week, _ = datetime.strptime(date, "%Y-%m-%d").isocalendar()
+    return f"{year}-W{week:02d}"
+
+def week_bounds(week: str, tz: ZoneInfo) -> tuple:
+    """Local dates and naive-UTC timestamp bounds of an ISO week like ``2026-W42``."""
+    try:
+        year, number = week.split("-W")
+        start = datetime.fromisocalendar(int(year), int(number), 1)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="week must look like YYYY-Www")
+    dates = [(start + timedelta(days=i)).strftime("%Y-%m-%d") for i in range(7)]
+    start_utc = start.replace(tzinfo=tz).astimezone(ZoneInfo("UTC")).replace(tzinfo=None)
+    return dates, start_utc, start_utc + timedelta(days=7)
+
+def compute_weekly_report(app_usage: List[dict], web_daily: List[dict], locations: List[dict], dates: List[str], timezone: str) -> dict:
+    """Aggregate one teen's week of activity. Runs in the report process pool."""
+    # Imported here so API workers never pay pandas' import cost at startup
+    import numpy as np
+    import pandas as pd
+    
+    usage = pd.DataFrame(app_usage, columns=["app_name", "package_name", "usage_time", "date"]).astype({"usage_time": "int64"})
+    daily_screen_time = usage.groupby("date")["usage_time"].sum().reindex(dates, fill_value=0)
+    top_apps = (
+        usage.groupby(["package_name", "app_name"], as_index=False)["usage_time"].sum()
+        .nlargest(REPORT_TOP_N, "usage_time")
+    )
+    
+    web = pd.DataFrame(web_daily, columns=["domain", "category", "visits"]).astype({"visits": "int64"})
+    top_domains = (
+        web.groupby("domain", as_index=False)
+        .agg(visits=("visits", "sum"), category=("category", "first"))
+        .nlargest(REPORT_TOP_N, "visits")
+    )
+    by_category = web.fillna({"category": "uncategorized"}).groupby("category")["visits"].sum()
+    
+    fixes = pd.DataFrame(locations, columns=["latitude", "longitude", "timestamp"])
+    daily_distance = pd.Series(0.0, index=dates)
+    if len(fixes) > 1:
+        fixes = fixes.sort_values("timestamp")
+        lat = np.radians(fixes["latitude"].to_numpy())
+        lon = np.radians(fixes["longitude"].to_numpy())
+        a = (np.sin(np.diff(lat) / 2) ** 2
+             + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(np.diff(lon) / 2) ** 2)
+        steps = 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+        local_dates = (
+            pd.to_datetime(fixes["timestamp"].iloc[1:], utc=True)
+            .dt.tz_convert(timezone).dt.strftime("%Y-%m-%d")
+        )
+        daily_distance = pd.Series(steps, index=local_dates.to_numpy()).groupby(level=0).sum().reindex(dates, fill_value=0.0)
+    
+    return {
+        "start_date": dates[0],
+        "end_date": dates[-1],
+        "screen_time": {
+            "total_minutes": int(daily_screen_time.sum()),
+            "daily_minutes": {date: int(minutes) for date, minutes in daily_screen_time.items()},
+            "top_apps": [
+                {"package_name": row.package_name, "app_name": row.app_name, "minutes": int(row.usage_time)}
+                for row in top_apps.itertuples()
+            ]
+        },
+        "web": {
+            "total_visits": int(web["visits"].sum()) if not web.empty else 0,
+            "top_domains": [
+                {"domain": row.domain, "category": row.category if isinstance(row.category, str) else None, "visits": int(row.visits)}
+                for row in top_domains.itertuples()
+            ],
+            "visits_by_category": {category: int(visits) for category, visits in by_category.items()}
+        },
+        "locations": {
+            "fixes": len(fixes),
+            "distance_km": round(float(daily_distance.sum()) / 1000, 2),
+            "daily_distance_km": {date: round(float(meters) / 1000, 2) for date, meters in daily_distance.items()}
+        }
     }
 
+async def invalidate_weekly_report(teen: dict, date: str):
+    # Only final reports (computed after their week ended) are cached long term
+    week = iso_week(date)
+    if week != iso_week(teen_local_date(teen)):
+        await db.weekly_reports.delete_one({"teen_id": teen["id"], "week": week})
+
+@api_router.get("/teens/{teen_id}/reports/weekly")
+async def get_weekly_report(teen_id: str, week: Optional[str] = None, parent_id: str = Depends(get_current_parent)):
+    # Verify teen belongs to parent
+    teen = await db.teens.find_one({"id": teen_id, "parent_id": parent_id})
+    if not teen:
+        raise HTTPException(status_code=404, detail="Teen not found")
+    
+    week = week or iso_week(teen_local_date(teen))
+    cached = await db.weekly_reports.find_one({"teen_id": teen_id, "week": week}, {"_id": 0})
+    # Reports computed before their week ended are partial and only kept briefly
+    if cached and (cached.get("final") or datetime.utcnow() - cached["computed_at"] < REPORT_CURRENT_WEEK_TTL):
+        return cached
+    
+    return await build_weekly_report(teen, week)
+
+async def build_weekly_report(teen: dict, week: str) -> dict:
+    teen_id = teen["id"]
+    tz = teen_timezone(teen)
+    dates, start, end = week_bounds(week, tz)
+    app_usage = await read_db.app_usage.find(
+        {"teen_id": teen_id, "date": {"$in": dates}},
+        {"_id": 0, "app_name": 1, "package_name": 1, "usage_time": 1, "date": 1}
+    ).to_list(None)
+    web_daily = await read_db.web_domain_daily.find(
+        {"teen_id": teen_id, "date": {"$in": dates}},
+        {"_id": 0, "domain": 1, "category": 1, "visits": 1}
+    ).to_list(None)
+    locations = await read_db.locations.find(
+        {"teen_id": teen_id, "timestamp": {"$gte": start, "$lt": end}},
+        {"_id": 0, "latitude": 1, "longitude": 1, "timestamp": 1}
+    ).to_list(None)
+    
+    # Keep the pandas work off the event loop
+    loop = asyncio.get_running_loop()
+    report = await loop.run_in_executor(
+        get_report_executor(), compute_weekly_report, app_usage, web_daily, locations, dates, str(tz)
+    )
+    computed_at = datetime.utcnow()
+    report.update({"teen_id": teen_id, "week": week, "computed_at": computed_at, "final": computed_at >= end})
+    await db.weekly_reports.replace_one({"teen_id": teen_id, "week": week}, report, upsert=True)
+    report.pop("_id", None)
+    return report
+
+# Background job scheduler
+SCHEDULER_MAX_CONCURRENCY = int(os.environ.get("SCHEDULER_MAX_CONCURRENCY", "2"))
+MAINTENANCE_TIMEOUT_MS = 3_600_000  # per startup phase group / scheduled job run
+# Retention is opt-in: data is only ever deleted when its *_RETENTION_DAYS is set
+def retention_days(name: str) -> Optional[int]:
+    value = os.environ.get(name)
+    return int(value) if value else None
+
+LOCATION_RETENTION_DAYS = retention_days("LOCATION_RETENTION_DAYS")
+WEB_HISTORY_RETENTION_DAYS = retention_days("WEB_HISTORY_RETENTION_DAYS")
+READ_ALERT_RETENTION_DAYS = retention_days("READ_ALERT_RETENTION_DAYS")
+
+class JobScheduler:
+    """In-process asyncio scheduler for periodic maintenance jobs.
+
+    Every worker runs the same schedule, but a job only executes on the worker
+    that wins its lease in ``scheduler_jobs``. The winner keeps the lease until
+    the next slot, so the other workers skip that cycle. Start times are jittered
+    and at most ``SCHEDULER_MAX_CONCURRENCY`` jobs run at once per worker.
+    """
+
+    def __init__(self, max_concurrency: int = SCHEDULER_MAX_CONCURRENCY):
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self.tasks: List[asyncio.Task] = []
+        self.max_concurrency = max_concurrency
+        self.semaphore: Optional[asyncio.Semaphore] = None
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        # Jobs scan whole collections, so they get a longer deadline than requests
+        self.job_timeout = MAINTENANCE_TIMEOUT_MS / 1000
+
+    def job(self, name: str, interval: timedelta, jitter: float = 60, at_hour: Optional[int] = None):
+        """Register a coroutine to run every ``interval``, optionally aligned to ``at_hour`` UTC."""
+        def register(func: Callable[[], Awaitable[Any]]):
+            self.jobs[name] = {
+                "name": name,
+                "func": func,
+                "interval": interval,
+                "jitter": jitter,
+                "at_hour": at_hour,
+                "next_run": None
+            }
+            return func
+        return register
+
+    def first_run(self, job: Dict[str, Any]) -> datetime:
+        now = datetime.utcnow()
+        if job["at_hour"] is None:
+            return now + timedelta(seconds=random.uniform(0, job["jitter"]))
+        start = now.replace(hour=job["at_hour"], minute=0, second=0, microsecond=0)
+        if start <= now:
+            start += timedelta(days=1)
+        return start
+
+    async def start(self):
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        for job in self.jobs.values():
+            job["next_run"] = self.first_run(job)
+            self.tasks.append(asyncio.create_task(self.run_loop(job)))
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def run_loop(self, job: Dict[str, Any]):
+        while True:
+            delay = (job["next_run"] - datetime.utcnow()).total_seconds() + random.uniform(0, job["jitter"])
+            await asyncio.sleep(max(delay, 0))
+            scheduled = job["next_run"]
+            job["next_run"] = scheduled + job["interval"]
+            async with self.semaphore:
+                try:
+                    await self.run_job(job, scheduled)
+                except Exception:
+                    # Lease bookkeeping failed (e.g. Mongo unavailable); try again next slot
+                    logging.getLogger(__name__).exception("Scheduling job %s failed", job["name"])
+
+    async def acquire(self, job: Dict[str, Any], now: datetime) -> bool:
+        try:
+            await db.scheduler_jobs.update_one(
+                {"_id": job["name"], "$or": [{"locked_until": {"$lte": now}}, {"locked_until": {"$exists": False}}]},
+                {"$set": {"owner": self.worker_id, "locked_until": now + job["interval"]}},
+                upsert=True
+            )
+            return True
+        except DuplicateKeyError:
+            return False  # another worker holds the lease for this slot
+
+    async def run_job(self, job: Dict[str, Any], scheduled: datetime):
+        started = datetime.utcnow()
+        if not await self.acquire(job, started):
+            return
+        
+        status, error = "success", None
+        start = time.perf_counter()
+        try:
+            with mongo_timeout(self.job_timeout):
+                await job["func"]()
+        except Exception as e:
+            status, error = "failed", repr(e)
+            logging.getLogger(__name__).exception("Scheduled job %s failed", job["name"])
+        duration = time.perf_counter() - start
+        
+        # Keep the lease until shortly before the next slot so peers skip this cycle
+        await db.scheduler_jobs.update_one(
+            {"_id": job["name"], "owner": self.worker_id},
+            {"$set": {
+                "locked_until": started + job["interval"] * 0.9,
+                "last_started_at": started,
+                "last_finished_at": datetime.utcnow(),
+                "last_duration_seconds": round(duration, 3),
+                "last_lag_seconds": round((started - scheduled).total_seconds(), 3),
+                "last_status": status,
+                "last_error": error
+            }}
+        )
+
+    async def status(self) -> List[Dict[str, Any]]:
+        runs = {doc["_id"]: doc for doc in await db.scheduler_jobs.find({}).to_list(100)}
+        statuses = []
+        for name, job in self.jobs.items():
+            run = runs.get(name, {})
+            statuses.append({
+                "name": name,
+                "interval_seconds": job["interval"].total_seconds(),
+                "next_run": job["next_run"],
+                "owner": run.get("owner"),
+                "last_started_at": run.get("last_started_at"),
+                "last_duration_seconds": run.get("last_duration_seconds"),
+                "last_lag_seconds": run.get("last_lag_seconds"),
+                "last_status": run.get("last_status"),
+                "last_error": run.get("last_error")
+            })
+        return statuses
+
+scheduler = JobScheduler()
+
+@scheduler.job("daily_rollups", interval=timedelta(days=1), jitter=300, at_hour=2)
+async def run_daily_rollups():
+    # Reconcile incremental screen time totals for the last two days from app_usage
+    now = datetime.utcnow()
+    dates = [(now - timedelta(days=offset)).strftime("%Y-%m-%d") for offset in (1, 2)]
+    totals = await db.app_usage.aggregate([
+        {"$match": {"date": {"$in": dates}}},
+        {"$group": {"_id": {"teen_id": "$teen_id", "date": "$date"}, "total": {"$sum": "$usage_time"}}}
+    ]).to_list(None)
+    for total in totals:
+        await db.screen_time_daily.update_one(
+            {"teen_id": total["_id"]["teen_id"], "date": total["_id"]["date"]},
+            {"$set": {"total": total["total"]}},
+            upsert=True
+        )
+
+@scheduler.job("weekly_report_precompute", interval=timedelta(days=1), jitter=300, at_hour=3)
+async def run_weekly_report_precompute():
+    # Have last week's report ready before parents open it
+    async for teen in db.teens.find({}, {"_id": 0, "id": 1, "timezone": 1}):
+        last_week = iso_week((datetime.now(teen_timezone(teen)) - timedelta(days=7)).strftime("%Y-%m-%d"))
+        if not await db.weekly_reports.find_one({"teen_id": teen["id"], "week": last_week, "final": True}, {"_id": 1}):
+            await build_weekly_report(teen, last_week)
+
+@scheduler.job("retention_compaction", interval=timedelta(days=1), jitter=300, at_hour=4)
+async def run_retention_compaction():
+    now = datetime.utcnow()
+    if LOCATION_RETENTION_DAYS:
+        await db.locations.delete_many({"timestamp": {"$lt": now - timedelta(days=LOCATION_RETENTION_DAYS)}})
+    if WEB_HISTORY_RETENTION_DAYS:
+        cutoff = now - timedelta(days=WEB_HISTORY_RETENTION_DAYS)
+        await db.web_history.delete_many({"timestamp": {"$lt": cutoff}})
+        await db.web_domain_daily.delete_many({"date": {"$lt": cutoff.strftime("%Y-%m-%d")}})
+    if READ_ALERT_RETENTION_DAYS:
+        await db.alerts.delete_many({"is_read": True, "created_at": {"$lt": now - timedelta(days=READ_ALERT_RETENTION_DAYS)}})
+
+@api_router.get("/admin/jobs", dependencies=[Depends(require_admin)])
+async def get_job_status():
+    return {"enabled": bool(scheduler.tasks), "worker_id": scheduler.worker_id, "jobs": await scheduler.status()}
+
+@api_router.get("/admin/db-pools", dependencies=[Depends(require_admin)])
+async def get_db_pool_metrics():
+    return {name: metrics.snapshot() for name, metrics in pool_metrics.items()}
+
+@api_router.get("/admin/startup", dependencies=[Depends(require_admin)])
+async def get_startup_timings(request: Request):
+    return getattr(request.app.state, "startup_timings", {})
+
+# Profiling: sampled stacks for the next N requests on a route, and event-loop lag
+PROFILE_DIR = Path(os.environ.get("PROFILE_DIR", ROOT_DIR / "profiles"))
+PROFILE_DEFAULT_INTERVAL = 0.005  # seconds between stack samples
+
+def collapse_stack(frame) -> str:
+    """Render a frame and its callers as one collapsed-stack (flamegraph) line."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+class StackSampler:
+    """Samples one thread's stack from a background thread every ``interval`` seconds.
+
+    Everything runs on the event loop thread, so the samples cover whatever the
+    loop executes while the profiled request is in flight, including other
+    requests. Time the loop spends idle in the selector is Mongo/network wait.
+    """
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="stack-sampler", daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[collapse_stack(frame)] += 1
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+
+class RequestProfiler:
+    """Captures the next N requests on armed routes as collapsed-stack files."""
+
+    def __init__(self):
+        self.armed: Dict[str, Dict[str, Any]] = {}
+        self.output_dir = PROFILE_DIR
+
+    def arm(self, route: str, requests: int, interval: float):
+        self.armed[route] = {"remaining": requests, "interval": interval}
+
+    def claim(self, request: Request) -> Optional[tuple]:
+        """Take one capture slot if this request's route is armed, returning (route, interval)."""
+        for route in request.app.routes:
+            if getattr(route, "path", None) in self.armed and route.matches(request.scope)[0] == Match.FULL:
+                capture = self.armed[route.path]
+                capture["remaining"] -= 1
+                if capture["remaining"] <= 0:
+                    del self.armed[route.path]
+                return route.path, capture["interval"]
+        return None
+
+    def write(self, route: str, stacks: Counter, elapsed: float) -> str:
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        slug = route.strip("/").replace("/", "_").replace("{", "").replace("}", "") or "root"
+        name = f"{slug}-{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}.folded"
+        with open(self.output_dir / name, "w") as f:
+            f.write(f"# {route} {elapsed * 1000:.1f}ms {sum(stacks.values())} samples\n")
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        return name
+
+    def files(self) -> List[str]:
+        if not self.output_dir.is_dir():
+            return []
+        return sorted((p.name for p in self.output_dir.glob("*.folded")), reverse=True)
+
+request_profiler = RequestProfiler()
+
+class ProfilingMiddleware:
+    """ASGI middleware that samples armed routes, or a request sent with ``X-Profile``
+    and a valid ``X-Admin-Token``. Unprofiled requests pass straight through."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        request = Request(scope)
+        capture = request_profiler.claim(request) if request_profiler.armed else None
+        if capture is None and "x-profile" in request.headers and ADMIN_TOKEN and hmac.compare_digest(
+                request.headers.get("x-admin-token", ""), ADMIN_TOKEN):
+            capture = request.url.path, PROFILE_DEFAULT_INTERVAL
+        if capture is None:
+            return await self.app(scope, receive, send)
+
+        route, interval = capture
+        started = time.perf_counter()
+        with StackSampler(threading.get_ident(), interval) as sampler:
+            await self.app(scope, receive, send)
+        name = await asyncio.get_running_loop().run_in_executor(
+            None, request_profiler.write, route, sampler.stacks, time.perf_counter() - started
+        )
+        logger.info("Profiled %s %s into %s", request.method, request.url.path, name)
+
+class LoopLagMonitor:
+    """Measures event-loop lag continuously and records the stack behind each stall.
+
+    A heartbeat task oversleeps by however long synchronous code holds the loop;
+    a watchdog thread notices a stale heartbeat while the stall is still
+    happening and captures the loop thread's stack, so the culprit gets named.
+    """
+
+    def __init__(self, interval: float = 0.1, threshold: float = 0.1):
+        self.interval = interval
+        self.threshold = threshold
+        self.lags: deque = deque(maxlen=600)
+        self.stalls: deque = deque(maxlen=50)
+        self.heartbeat = time.perf_counter()
+        self.task: Optional[asyncio.Task] = None
+        self.watchdog: Optional[threading.Thread] = None
+        self.stopped = threading.Event()
+
+    async def start(self):
+        self.stopped.clear()
+        self.heartbeat = time.perf_counter()
+        self.task = asyncio.create_task(self.run())
+        self.watchdog = threading.Thread(target=self.watch, args=(threading.get_ident(),), name="loop-watchdog", daemon=True)
+        self.watchdog.start()
+
+    async def stop(self):
+        self.stopped.set()
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+        if self.watchdog:
+            self.watchdog.join()
+        self.task = self.watchdog = None
+
+    async def run(self):
+        while True:
+            before = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.heartbeat = time.perf_counter()
+            lag = self.heartbeat - before - self.interval
+            self.lags.append(lag)
+            if lag > self.threshold:
+                logger.warning("Event loop blocked for %.0fms", lag * 1000)
+
+    def watch(self, loop_thread_id: int):
+        flagged = None
+        while not self.stopped.wait(self.threshold / 2):
+            heartbeat = self.heartbeat
+            if time.perf_counter() - heartbeat < self.interval + self.threshold or flagged == heartbeat:
+                continue
+            flagged = heartbeat
+            frame = sys._current_frames().get(loop_thread_id)
+            if frame is not None:
+                stack = collapse_stack(frame)
+                self.stalls.append({"at": datetime.utcnow(), "stack": stack})
+                logger.warning("Slow synchronous code on the event loop: %s", stack)
+
+    def snapshot(self) -> Dict[str, Any]:
+        lags = sorted(self.lags)
+        def percentile(p: float) -> float:
+            return round(lags[min(len(lags) - 1, int(len(lags) * p))] * 1000, 2) if lags else 0.0
+        return {
+            "running": self.task is not None,
+            "threshold_ms": self.threshold * 1000,
+            "samples": len(lags),
+            "p50_ms": percentile(0.5),
+            "p99_ms": percentile(0.99),
+            "max_ms": percentile(1.0),
+            "stalls": list(self.stalls)
+        }
+
+loop_lag_monitor = LoopLagMonitor()
+
+class ProfileCapture(BaseModel):
+    route: str  # route template, e.g. /api/dashboard/{teen_id}
+    requests: int = Field(10, ge=1, le=1000)
+    interval_ms: float = Field(PROFILE_DEFAULT_INTERVAL * 1000, ge=1, le=1000)
+
+@api_router.post("/admin/profiles", dependencies=[Depends(require_admin)])
+async def arm_profiler(capture: ProfileCapture, request: Request):
+    if capture.route not in {getattr(route, "path", None) for route in request.app.routes}:
+        raise HTTPException(status_code=404, detail="Unknown route")
+    request_profiler.arm(capture.route, capture.requests, capture.interval_ms / 1000)
+    return {"armed": request_profiler.armed}
+
+@api_router.get("/admin/profiles", dependencies=[Depends(require_admin)])
+async def list_profiles():
+    return {"armed": request_profiler.armed, "files": request_profiler.files()}
+
+@api_router.get("/admin/profiles/{name}", dependencies=[Depends(require_admin)])
+async def get_profile(name: str):
+    if name not in request_profiler.files():
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(request_profiler.output_dir / name, media_type="text/plain")
+
+@api_router.get("/admin/loop-lag", dependencies=[Depends(require_admin)])
+async def get_loop_lag():
+    return loop_lag_monitor.snapshot()
+
 # WebSocket endpoint for real-time updates
-@app.websocket("/ws/{parent_id}")
+PARENT_WATCH_TTL_SECONDS = 60
+
+async def mark_parent_watching(parent_id: str):
+    # Ingest on any worker reads this from teen_state to sample faster while watched
+    while True:
+        await db.teen_state.update_many(
+            {"parent_id": parent_id},
+            {"$set": {"watched_until": datetime.utcnow() + timedelta(seconds=PARENT_WATCH_TTL_SECONDS)}}
+        )
+        await asyncio.sleep(PARENT_WATCH_TTL_SECONDS / 2)
+
+@ws_router.websocket("/ws/{parent_id}")
 async def websocket_endpoint(websocket: WebSocket, parent_id: str):
     await manager.connect(websocket, parent_id)
+    watching = asyncio.create_task(mark_parent_watching(parent_id))
     try:
         while True:
             data = await websocket.receive_text()
             # Keep connection alive
     except WebSocketDisconnect:
         manager.disconnect(parent_id)
-
-# Include the router in the main app
-app.include_router(api_router)
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_credentials=True,
-    allow_origins=["*"],
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+    finally:
+        watching.cancel()
 
 # Configure logging
 logging.basicConfig(
@@ -558,6 +2425,203 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+async def backfill_controls_versions():
+    """Give controls and teens created before versioned sync a version devices can fetch."""
+    await db.app_controls.update_many({"version": {"$exists": False}}, {"$set": {"version": 1}})
+    await db.teens.update_many({"controls_version": {"$exists": False}}, {"$set": {"controls_version": 1}})
+
+async def create_indexes():
+    await asyncio.gather(
+        db.idempotency_keys.create_index("key", unique=True),
+        db.idempotency_keys.create_index("created_at", expireAfterSeconds=IDEMPOTENCY_KEY_TTL_SECONDS),
+        db.teens.create_index("id", unique=True),
+        db.teens.create_index("parent_id"),
+        db.geofences.create_index("teen_id"),
+        db.geofences.create_index("parent_id"),
+        db.geofences.create_index("teen_ids"),
+        db.app_controls.create_index([("teen_id", 1), ("version", 1)]),
+        db.screen_time_daily.create_index([("teen_id", 1), ("date", 1)], unique=True),
+        db.web_history.create_index([("teen_id", 1), ("url", 1)]),
+        db.visits.create_index([("teen_id", 1), ("arrived_at", -1)]),
+        db.teen_state.create_index("teen_id", unique=True),
+        db.teen_state.create_index("parent_id"),
+        db.alerts.create_index([("parent_id", 1), ("teen_id", 1), ("is_read", 1), ("created_at", -1)]),
+        db.alerts.create_index("read_batch", sparse=True),
+        db.weekly_reports.create_index([("teen_id", 1), ("week", 1)], unique=True),
+        db.locations.create_index([("teen_id", 1), ("timestamp", -1)]),
+        db.web_history.create_index([("teen_id", 1), ("timestamp", -1)]),
+        db.app_usage.create_index([("teen_id", 1), ("date", 1)]),
+        db.web_domain_stats.create_index([("teen_id", 1), ("domain", 1)], unique=True),
+        db.web_domain_stats.create_index([("teen_id", 1), ("visit_count", -1)]),
+        db.web_domain_daily.create_index([("teen_id", 1), ("date", 1), ("domain", 1)], unique=True)
+    )
+
+async def warm_caches(limit: int):
+    teens = await db.teens.find({}, {"_id": 0}).limit(limit).to_list(limit)
+    for teen in teens:
+        teen_cache.set(teen["id"], teen)
+    
+    # One shared geofence index per parent
+    parent_of = {teen["id"]: teen["parent_id"] for teen in teens}
+    geofences: Dict[str, List[dict]] = {parent_id: [] for parent_id in parent_of.values()}
+    async for geofence in db.geofences.find(
+        {"$or": [{"parent_id": {"$in": list(geofences)}}, {"teen_id": {"$in": list(parent_of)}}]}, {"_id": 0}
+    ):
+        parent_id = geofence.get("parent_id") or parent_of.get(geofence["teen_id"])
+        if parent_id in geofences:
+            geofences[parent_id].append(geofence)
+    for parent_id, parent_geofences in geofences.items():
+        geofence_cache.set(parent_id, GeofenceIndex(parent_geofences))
+
+def load_reference_data():
+    global gazetteer, domain_matcher, restricted_categories
+    gazetteer = Gazetteer.from_file(GAZETTEER_FILE)
+    domain_matcher = DomainMatcher.from_file(DOMAIN_CATEGORIES_FILE)
+    restricted_categories = load_restricted_categories(DOMAIN_CATEGORIES_FILE)
+
+# Application factory
+def create_mongo_clients(settings: "Settings") -> tuple:
+    """Separate connection pools for device ingest and for dashboard/history reads."""
+    pool_metrics["ingest"] = PoolMetrics("ingest")
+    pool_metrics["read"] = PoolMetrics("read")
+    ingest_client = AsyncIOMotorClient(
+        settings.mongo_url,
+        w=1,
+        maxPoolSize=settings.ingest_max_pool_size,
+        minPoolSize=settings.ingest_min_pool_size,
+        serverSelectionTimeoutMS=settings.server_selection_timeout_ms,
+        timeoutMS=settings.operation_timeout_ms,
+        event_listeners=[pool_metrics["ingest"]]
+    )
+    dashboard_client = AsyncIOMotorClient(
+        settings.read_mongo_url or settings.mongo_url,
+        read_preference=SecondaryPreferred(max_staleness=settings.read_max_staleness_seconds),
+        maxPoolSize=settings.read_max_pool_size,
+        serverSelectionTimeoutMS=settings.server_selection_timeout_ms,
+        timeoutMS=settings.operation_timeout_ms,
+        event_listeners=[pool_metrics["read"]]
+    )
+    return ingest_client, dashboard_client
+
+class Settings(BaseModel):
+    mongo_url: str = "mongodb://localhost:27017"
+    read_mongo_url: Optional[str] = None  # defaults to mongo_url
+    db_name: str = "test_database"
+    # Ingest pool: fire-and-acknowledge writes (w=1), always on the primary
+    ingest_max_pool_size: int = 100
+    ingest_min_pool_size: int = 10
+    # Dashboard/history pool: may read from secondaries up to the staleness bound
+    read_max_pool_size: int = 50
+    read_max_staleness_seconds: int = 120  # MongoDB requires at least 90
+    server_selection_timeout_ms: int = 5000
+    operation_timeout_ms: int = 10000  # request paths; see maintenance_timeout_ms
+    maintenance_timeout_ms: int = MAINTENANCE_TIMEOUT_MS  # index builds, backfill, scheduled jobs
+    build_indexes: bool = True
+    warm_caches: bool = True
+    warm_cache_limit: int = 10000
+    scheduler_enabled: bool = True
+    loop_lag_monitor: bool = True
+    loop_lag_threshold_ms: float = 100
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        defaults = cls()
+        return cls(
+            mongo_url=os.environ.get("MONGO_URL", defaults.mongo_url),
+            read_mongo_url=os.environ.get("READ_MONGO_URL"),
+            db_name=os.environ.get("DB_NAME", defaults.db_name),
+            ingest_max_pool_size=int(os.environ.get("INGEST_MAX_POOL_SIZE", defaults.ingest_max_pool_size)),
+            ingest_min_pool_size=int(os.environ.get("INGEST_MIN_POOL_SIZE", defaults.ingest_min_pool_size)),
+            read_max_pool_size=int(os.environ.get("READ_MAX_POOL_SIZE", defaults.read_max_pool_size)),
+            read_max_staleness_seconds=int(os.environ.get("READ_MAX_STALENESS_SECONDS", defaults.read_max_staleness_seconds)),
+            server_selection_timeout_ms=int(os.environ.get("SERVER_SELECTION_TIMEOUT_MS", defaults.server_selection_timeout_ms)),
+            operation_timeout_ms=int(os.environ.get("OPERATION_TIMEOUT_MS", defaults.operation_timeout_ms)),
+            maintenance_timeout_ms=int(os.environ.get("MAINTENANCE_TIMEOUT_MS", defaults.maintenance_timeout_ms)),
+            build_indexes=os.environ.get("BUILD_INDEXES", "true").lower() == "true",
+            warm_caches=os.environ.get("WARM_CACHES", "true").lower() == "true",
+            scheduler_enabled=os.environ.get("SCHEDULER_ENABLED", "true").lower() == "true",
+            loop_lag_monitor=os.environ.get("LOOP_LAG_MONITOR", "true").lower() == "true",
+            loop_lag_threshold_ms=float(os.environ.get("LOOP_LAG_THRESHOLD_MS", defaults.loop_lag_threshold_ms))
+        )
+
+def create_app(settings: Optional[Settings] = None, mongo_client: Optional[AsyncIOMotorClient] = None) -> FastAPI:
+    """Build the API app. Nothing connects until the lifespan starts.
+
+    Startup opens the Mongo pool, then builds indexes, warms the ingest caches
+    and loads reference data concurrently, recording each phase's duration in
+    ``app.state.startup_timings``. ``mongo_client`` lets tests and benchmarks
+    supply their own client.
+    """
+    settings = settings or Settings.from_env()
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        global client, read_client, db, read_db, manager, report_executor
+        timings: Dict[str, float] = {}
+        started = time.perf_counter()
+
+        async def timed(phase: str, coro: Awaitable[Any]):
+            phase_started = time.perf_counter()
+            await coro
+            timings[phase] = round(time.perf_counter() - phase_started, 4)
+
+        if mongo_client is not None:
+            client = read_client = mongo_client
+        else:
+            client, read_client = create_mongo_clients(settings)
+        db = client[settings.db_name]
+        read_db = read_client[settings.db_name]
+        manager = ConnectionManager()
+        await timed("db_connect", client.admin.command("ping"))
+
+        phases = [timed("reference_data", asyncio.get_running_loop().run_in_executor(None, load_reference_data))]
+        if settings.build_indexes:
+            phases.append(timed("indexes", create_indexes()))
+            phases.append(timed("backfill", backfill_controls_versions()))
+        if settings.warm_caches:
+            phases.append(timed("warm_caches", warm_caches(settings.warm_cache_limit)))
+        # The client's timeoutMS is sized for requests; index builds and the
+        # backfill run under the maintenance deadline instead
+        with mongo_timeout(settings.maintenance_timeout_ms / 1000):
+            await asyncio.gather(*phases)
+
+        scheduler.job_timeout = settings.maintenance_timeout_ms / 1000
+        if settings.scheduler_enabled:
+            await timed("scheduler", scheduler.start())
+        if settings.loop_lag_monitor:
+            loop_lag_monitor.threshold = settings.loop_lag_threshold_ms / 1000
+            await loop_lag_monitor.start()
+        timings["total"] = round(time.perf_counter() - started, 4)
+        app.state.startup_timings = timings
+        logger.info("Startup finished in %.3fs: %s", timings["total"], timings)
+
+        try:
+            yield
+        finally:
+            await scheduler.stop()
+            await loop_lag_monitor.stop()
+            client.close()
+            if read_client is not client:
+                read_client.close()
+            if report_executor is not None:
+                report_executor.shutdown(wait=False, cancel_futures=True)
+                report_executor = None  # a later lifespan starts a fresh pool
+
+    # Create the main app without a prefix
+    app = FastAPI(lifespan=lifespan)
+
+    # Include the routers in the main app
+    app.include_router(api_router)
+    app.include_router(ws_router)
+    app.add_middleware(ProfilingMiddleware)
+
+    app.add_middleware(
+        CORSMiddleware,
+        allow_credentials=True,
+        allow_origins=["*"],
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    return app
+
+app = create_app()
@@ -10,6 +10,7 @@ import json
 import time
 from datetime import datetime, timedelta
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 # Configuration
 BASE_URL = "https://incognito-eye-1.preview.emergentagent.com/api"
@@ -54,6 +55,8 @@ class ParentalMonitoringTester:
                 response = requests.post(url, headers=headers, json=data, timeout=30)
             elif method.upper() == "PUT":
                 response = requests.put(url, headers=headers, json=data, timeout=30)
+            elif method.upper() == "DELETE":
+                response = requests.delete(url, headers=headers, timeout=30)
             else:
                 raise ValueError(f"Unsupported method: {method}")
             
@@ -178,6 +181,22 @@ class ParentalMonitoringTester:
             self.log_result("Get Teens", False, f"HTTP {response.status_code}", response.text)
             return False
     
+    def test_teens_overview(self):
+        """Test the per-parent overview of every teen's live state"""
+        response = self.make_request("GET", "/teens/overview")
+        
+        if response.status_code == 200:
+            overview = response.json()
+            if isinstance(overview, list) and all("teen" in item and "unread_alerts" in item for item in overview):
+                self.log_result("Teens Overview", True, f"Retrieved live state for {len(overview)} teens")
+                return True
+            else:
+                self.log_result("Teens Overview", False, "Unexpected response format", overview)
+                return False
+        else:
+            self.log_result("Teens Overview", False, f"HTTP {response.status_code}", response.text)
+            return False
+    
     def test_get_individual_teen(self):
         """Test retrieving individual teen"""
         if not self.teen_id:
@@ -242,6 +261,103 @@ class ParentalMonitoringTester:
             self.log_result("Create Location", False, f"HTTP {response.status_code}", response.text)
             return False
     
+    def test_location_sampling_hints(self):
+        """Test that location uploads return sampling hints that tighten when moving"""
+        teen_response = self.make_request("POST", "/teens", {"name": "Sampling Tester", "device_id": f"device_{uuid.uuid4().hex[:12]}"})
+        if teen_response.status_code != 200:
+            self.log_result("Location Sampling Hints", False, f"Create teen HTTP {teen_response.status_code}", teen_response.text)
+            return False
+        teen_id = teen_response.json()["id"]
+        
+        started = datetime.utcnow() - timedelta(minutes=2)
+        hints = []
+        # First fix has nothing to compare with; the second moved ~1.1 km in a minute
+        for seconds, latitude in ((0, 51.5007), (60, 51.5107)):
+            response = self.make_request("POST", "/locations", {
+                "teen_id": teen_id,
+                "latitude": latitude,
+                "longitude": -0.1246,
+                "timestamp": (started + timedelta(seconds=seconds)).isoformat()
+            }, auth_required=False)
+            if response.status_code != 200 or "sampling" not in response.json():
+                self.log_result("Location Sampling Hints", False, "Missing sampling hints", response.text)
+                return False
+            hints.append(response.json()["sampling"])
+        
+        stationary, moving = hints
+        if moving["next_report_seconds"] < stationary["next_report_seconds"] and all("min_displacement_m" in h for h in hints):
+            self.log_result("Location Sampling Hints", True, f"Report interval {stationary['next_report_seconds']}s at rest, {moving['next_report_seconds']}s moving")
+            return True
+        else:
+            self.log_result("Location Sampling Hints", False, "Moving device was not asked to report sooner", hints)
+            return False
+    
+    def test_visits_and_frequent_places(self):
+        """Test that a 20 minute stay becomes one visit and one frequent place"""
+        teen_response = self.make_request("POST", "/teens", {"name": "Stay Tester", "device_id": f"device_{uuid.uuid4().hex[:12]}"})
+        if teen_response.status_code != 200:
+            self.log_result("Visits And Frequent Places", False, f"Create teen HTTP {teen_response.status_code}", teen_response.text)
+            return False
+        teen_id = teen_response.json()["id"]
+        
+        # Fixes carry their capture time so the stay can span the minimum dwell
+        arrived = datetime.utcnow() - timedelta(minutes=30)
+        def post_fix(minutes, latitude=40.7580, longitude=-73.9855):
+            return self.make_request("POST", "/locations", {
+                "teen_id": teen_id,
+                "latitude": latitude,
+                "longitude": longitude,
+                "timestamp": (arrived + timedelta(minutes=minutes)).isoformat()
+            }, auth_required=False)
+        
+        post_fix(0)
+        # Fixes inside the stay race each other, exercising the shared candidate updates
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            list(pool.map(post_fix, [5, 10, 15]))
+        post_fix(20)
+        post_fix(2)  # arrives late and must be ignored
+        post_fix(25, 40.7800, -73.9700)  # moving away closes the stay
+        
+        visits = self.make_request("GET", f"/teens/{teen_id}/visits").json()
+        places = self.make_request("GET", f"/teens/{teen_id}/frequent-places").json()
+        if len(visits) == 1 and visits[0]["dwell_minutes"] == 20 and len(places) == 1 and places[0]["visit_count"] == 1:
+            self.log_result("Visits And Frequent Places", True, "One 20 minute visit and one frequent place detected")
+            return True
+        else:
+            self.log_result("Visits And Frequent Places", False, "Unexpected visits or places", {"visits": visits, "places": places})
+            return False
+    
+    def test_idempotent_location_upload(self):
+        """Test that retried location uploads with the same Idempotency-Key are deduplicated"""
+        if not self.teen_id:
+            self.log_result("Idempotent Location Upload", False, "No teen ID available")
+            return False
+        
+        location_data = {
+            "teen_id": self.teen_id,
+            "latitude": 37.7750,
+            "longitude": -122.4195
+        }
+        key = str(uuid.uuid4())
+        
+        self.headers["Idempotency-Key"] = key
+        try:
+            first = self.make_request("POST", "/locations", location_data, auth_required=False)
+            retry = self.make_request("POST", "/locations", location_data, auth_required=False)
+        finally:
+            del self.headers["Idempotency-Key"]
+        
+        if first.status_code != 200 or retry.status_code != 200:
+            self.log_result("Idempotent Location Upload", False, f"HTTP {first.status_code}/{retry.status_code}", retry.text)
+            return False
+        
+        if first.json().get("location_id") == retry.json().get("location_id"):
+            self.log_result("Idempotent Location Upload", True, "Retry returned the original location record")
+            return True
+        else:
+            self.log_result("Idempotent Location Upload", False, "Retry created a duplicate location", [first.json(), retry.json()])
+            return False
+    
     def test_geofencing(self):
         """Test geofencing functionality"""
         if not self.teen_id:
@@ -288,6 +404,47 @@ class ParentalMonitoringTester:
             self.log_result("Create Geofence", False, f"HTTP {response.status_code}", response.text)
             return False
     
+    def test_shared_geofence(self):
+        """Test that one family geofence is evaluated for every teen it covers"""
+        teen_ids = []
+        for name in ("Sam Sibling", "Riley Sibling"):
+            response = self.make_request("POST", "/teens", {"name": name, "device_id": f"device_{uuid.uuid4().hex[:12]}"})
+            if response.status_code != 200:
+                self.log_result("Shared Geofence", False, f"Create teen HTTP {response.status_code}", response.text)
+                return False
+            teen_ids.append(response.json()["id"])
+        
+        fence_name = f"School {uuid.uuid4().hex[:6]}"
+        response = self.make_request("POST", "/geofences", {
+            "teen_ids": teen_ids,
+            "name": fence_name,
+            "latitude": 48.8584,
+            "longitude": 2.2945,
+            "radius": 200.0
+        })
+        if response.status_code != 200 or response.json().get("teen_ids") != teen_ids:
+            self.log_result("Shared Geofence", False, f"Create shared geofence HTTP {response.status_code}", response.text)
+            return False
+        
+        for teen_id in teen_ids:
+            names = [g["name"] for g in self.make_request("GET", f"/teens/{teen_id}/geofences").json()]
+            if fence_name not in names:
+                self.log_result("Shared Geofence", False, "Shared geofence missing from a teen's list", names)
+                return False
+        
+        # Only the second teen goes inside the fence
+        self.make_request("POST", "/locations", {"teen_id": teen_ids[0], "latitude": 48.8700, "longitude": 2.3300}, auth_required=False)
+        self.make_request("POST", "/locations", {"teen_id": teen_ids[1], "latitude": 48.8584, "longitude": 2.2945}, auth_required=False)
+        
+        alerts = self.make_request("GET", "/alerts").json()
+        entered = [a["teen_id"] for a in alerts if a["type"] == "geofence_enter" and fence_name in a["message"]]
+        if entered == [teen_ids[1]]:
+            self.log_result("Shared Geofence", True, "Shared geofence listed for both teens and alerted only for the one inside")
+            return True
+        else:
+            self.log_result("Shared Geofence", False, "Unexpected geofence alerts", entered)
+            return False
+    
     def test_app_usage_tracking(self):
         """Test app usage tracking functionality"""
         if not self.teen_id:
@@ -331,6 +488,57 @@ class ParentalMonitoringTester:
             self.log_result("Create App Usage", False, f"HTTP {response.status_code}", response.text)
             return False
     
+    def test_screen_time_limit_alert(self):
+        """Test that crossing the daily screen time limit raises exactly one alert"""
+        teen_response = self.make_request("POST", "/teens", {
+            "name": "Limit Tester",
+            "device_id": f"device_{uuid.uuid4().hex[:12]}"
+        })
+        if teen_response.status_code != 200:
+            self.log_result("Screen Time Limit Alert", False, f"Create teen HTTP {teen_response.status_code}", teen_response.text)
+            return False
+        teen_id = teen_response.json()["id"]
+        
+        limits_response = self.make_request("PUT", f"/teens/{teen_id}/screen-time-limits", {"default": 30})
+        if limits_response.status_code != 200:
+            self.log_result("Screen Time Limit Alert", False, f"Set limits HTTP {limits_response.status_code}", limits_response.text)
+            return False
+        
+        today = datetime.utcnow().strftime("%Y-%m-%d")
+        for minutes in (20, 35, 40):
+            self.make_request("POST", "/app-usage", {
+                "teen_id": teen_id,
+                "app_name": "YouTube",
+                "package_name": "com.google.android.youtube",
+                "usage_time": minutes,
+                "date": today
+            }, auth_required=False)
+        
+        alerts = self.make_request("GET", "/alerts").json()
+        limit_alerts = [a for a in alerts if a["teen_id"] == teen_id and a["type"] == "screen_time"]
+        if len(limit_alerts) == 1:
+            self.log_result("Screen Time Limit Alert", True, "Crossing the daily limit alerted once")
+            return True
+        else:
+            self.log_result("Screen Time Limit Alert", False, f"Expected 1 screen time alert, got {len(limit_alerts)}", limit_alerts)
+            return False
+    
+    def test_update_teen_timezone(self):
+        """Test setting the timezone used for a teen's screen time days"""
+        if not self.teen_id:
+            self.log_result("Update Teen Timezone", False, "No teen ID available")
+            return False
+        
+        invalid = self.make_request("PUT", f"/teens/{self.teen_id}/timezone", {"timezone": "Not/AZone"})
+        response = self.make_request("PUT", f"/teens/{self.teen_id}/timezone", {"timezone": "America/Los_Angeles"})
+        
+        if invalid.status_code == 400 and response.status_code == 200 and response.json()["timezone"] == "America/Los_Angeles":
+            self.log_result("Update Teen Timezone", True, "Timezone updated and unknown zones rejected")
+            return True
+        else:
+            self.log_result("Update Teen Timezone", False, f"HTTP {invalid.status_code}/{response.status_code}", response.text)
+            return False
+    
     def test_web_history_tracking(self):
         """Test web history tracking functionality"""
         if not self.teen_id:
@@ -372,6 +580,83 @@ class ParentalMonitoringTester:
             self.log_result("Create Web History", False, f"HTTP {response.status_code}", response.text)
             return False
     
+    def test_app_controls_sync(self):
+        """Test device delta sync of app controls, including 304 and deletions"""
+        if not self.teen_id:
+            self.log_result("App Controls Sync", False, "No teen ID available")
+            return False
+        
+        sync_url = f"/teens/{self.teen_id}/app-controls/sync"
+        baseline = self.make_request("GET", sync_url, auth_required=False)
+        if baseline.status_code == 200:
+            version = baseline.json()["version"]
+        elif baseline.status_code == 304:
+            version = int(baseline.headers["X-Controls-Version"])
+        else:
+            self.log_result("App Controls Sync", False, f"HTTP {baseline.status_code}", baseline.text)
+            return False
+        
+        unchanged = self.make_request("GET", f"{sync_url}?since_version={version}", auth_required=False)
+        if unchanged.status_code != 304:
+            self.log_result("App Controls Sync", False, f"Expected 304 when up to date, got HTTP {unchanged.status_code}")
+            return False
+        
+        control_data = {"teen_id": self.teen_id, "package_name": f"com.example.{uuid.uuid4().hex[:6]}", "is_blocked": True}
+        created = self.make_request("POST", "/app-controls", control_data)
+        if created.status_code != 200:
+            self.log_result("App Controls Sync", False, f"Create control HTTP {created.status_code}", created.text)
+            return False
+        control = created.json()
+        
+        delta = self.make_request("GET", f"{sync_url}?since_version={version}", auth_required=False)
+        if delta.status_code != 200 or [c["id"] for c in delta.json()["controls"]] != [control["id"]]:
+            self.log_result("App Controls Sync", False, "Delta did not contain exactly the new control", delta.text)
+            return False
+        version = delta.json()["version"]
+        
+        self.make_request("DELETE", f"/app-controls/{control['id']}")
+        removal = self.make_request("GET", f"{sync_url}?since_version={version}", auth_required=False)
+        if removal.status_code == 200 and removal.json()["deleted"] == [control["id"]]:
+            self.log_result("App Controls Sync", True, "Delta sync returned changes, deletions and 304 when current")
+            return True
+        else:
+            self.log_result("App Controls Sync", False, "Deletion not reported by sync", removal.text)
+            return False
+    
+    def test_web_history_normalization(self):
+        """Test that tracking variants of a URL dedupe and are classified by domain"""
+        if not self.teen_id:
+            self.log_result("Web History Normalization", False, "No teen ID available")
+            return False
+        
+        variants = [
+            "https://m.youtube.com/watch?v=normalize&utm_source=newsletter",
+            "HTTPS://M.YouTube.com:443/watch?fbclid=abc&v=normalize"
+        ]
+        responses = [
+            self.make_request("POST", "/web-history", {"teen_id": self.teen_id, "url": url, "title": "Video"}, auth_required=False)
+            for url in variants
+        ]
+        if any(response.status_code != 200 for response in responses):
+            self.log_result("Web History Normalization", False, "Upload failed", [r.text for r in responses])
+            return False
+        
+        first, second = (response.json() for response in responses)
+        if first["history_id"] != second["history_id"]:
+            self.log_result("Web History Normalization", False, "Tracking variants were stored separately", [first, second])
+            return False
+        if (second["domain"], second["category"]) != ("youtube.com", "video"):
+            self.log_result("Web History Normalization", False, "Unexpected classification", second)
+            return False
+        
+        malformed = self.make_request("POST", "/web-history", {"teen_id": self.teen_id, "url": "http://host:99999/", "title": "Bad port"}, auth_required=False)
+        if malformed.status_code == 200:
+            self.log_result("Web History Normalization", True, "Variants deduped, classified as video, malformed URL accepted")
+            return True
+        else:
+            self.log_result("Web History Normalization", False, f"Malformed URL HTTP {malformed.status_code}", malformed.text)
+            return False
+    
     def test_alerts_system(self):
         """Test alerts system functionality"""
         if not self.auth_token:
@@ -402,6 +687,79 @@ class ParentalMonitoringTester:
             self.log_result("Get Alerts", False, f"HTTP {response.status_code}", response.text)
             return False
     
+    def test_bulk_mark_alerts_read(self):
+        """Test that bulk mark-read keeps the unread counters exact"""
+        teen_response = self.make_request("POST", "/teens", {
+            "name": "Alert Counter",
+            "device_id": f"device_{uuid.uuid4().hex[:12]}"
+        })
+        if teen_response.status_code != 200:
+            self.log_result("Bulk Mark Alerts Read", False, f"Create teen HTTP {teen_response.status_code}", teen_response.text)
+            return False
+        teen_id = teen_response.json()["id"]
+        
+        # A one-minute daily limit and app limit produce two alerts from one report
+        package = "com.example.counter"
+        self.make_request("PUT", f"/teens/{teen_id}/screen-time-limits", {"default": 1})
+        self.make_request("POST", "/app-controls", {"teen_id": teen_id, "package_name": package, "time_limit": 1})
+        self.make_request("POST", "/app-usage", {
+            "teen_id": teen_id,
+            "app_name": "Counter",
+            "package_name": package,
+            "usage_time": 5,
+            "date": datetime.utcnow().strftime("%Y-%m-%d")
+        }, auth_required=False)
+        
+        alert_ids = [a["id"] for a in self.make_request("GET", "/alerts?unread_only=true").json() if a["teen_id"] == teen_id]
+        counts = [self.make_request("GET", "/alerts/count").json()["teens"].get(teen_id)]
+        if len(alert_ids) != 2:
+            self.log_result("Bulk Mark Alerts Read", False, f"Expected 2 unread alerts, got {len(alert_ids)}")
+            return False
+        
+        first = self.make_request("PUT", "/alerts/read", {"alert_ids": alert_ids[:1], "teen_id": teen_id}).json()
+        counts.append(self.make_request("GET", "/alerts/count").json()["teens"].get(teen_id))
+        # The first alert is already read and must not be counted twice
+        second = self.make_request("PUT", "/alerts/read", {"alert_ids": alert_ids}).json()
+        counts.append(self.make_request("GET", "/alerts/count").json()["teens"].get(teen_id))
+        
+        if (first["updated"], second["updated"], counts) == (1, 1, [2, 1, 0]):
+            self.log_result("Bulk Mark Alerts Read", True, "Unread counter went 2 -> 1 -> 0 across overlapping batches")
+            return True
+        else:
+            self.log_result("Bulk Mark Alerts Read", False, "Unexpected counter values", {"updated": [first, second], "counts": counts})
+            return False
+    
+    def test_weekly_report(self):
+        """Test the weekly activity report for the current week"""
+        if not self.teen_id:
+            self.log_result("Weekly Report", False, "No teen ID available")
+            return False
+        
+        response = self.make_request("GET", f"/teens/{self.teen_id}/reports/weekly")
+        if response.status_code != 200:
+            self.log_result("Weekly Report", False, f"HTTP {response.status_code}", response.text)
+            return False
+        
+        report = response.json()
+        missing_fields = [field for field in ["week", "screen_time", "web", "locations", "final"] if field not in report]
+        if missing_fields:
+            self.log_result("Weekly Report", False, f"Missing fields: {missing_fields}", report)
+            return False
+        if len(report["screen_time"]["daily_minutes"]) != 7 or report["final"]:
+            self.log_result("Weekly Report", False, "Current week should cover 7 days and not be final", report)
+            return False
+        if report["web"]["total_visits"] < 1:
+            self.log_result("Weekly Report", False, "Web visits uploaded this week are missing", report["web"])
+            return False
+        
+        invalid = self.make_request("GET", f"/teens/{self.teen_id}/reports/weekly?week=not-a-week")
+        if invalid.status_code == 400:
+            self.log_result("Weekly Report", True, f"Report for {report['week']}: {report['screen_time']['total_minutes']} minutes, {report['web']['total_visits']} visits")
+            return True
+        else:
+            self.log_result("Weekly Report", False, f"Invalid week returned HTTP {invalid.status_code}")
+            return False
+    
     def test_dashboard_data(self):
         """Test dashboard data retrieval"""
         if not self.teen_id:
@@ -441,18 +799,29 @@ class ParentalMonitoringTester:
         self.test_create_teen()
         self.test_get_teens()
         self.test_get_individual_teen()
+        self.test_update_teen_timezone()
         
         # Core monitoring tests
         self.test_location_tracking()
+        self.test_idempotent_location_upload()
+        self.test_visits_and_frequent_places()
+        self.test_location_sampling_hints()
         self.test_app_usage_tracking()
+        self.test_screen_time_limit_alert()
         self.test_web_history_tracking()
+        self.test_web_history_normalization()
+        self.test_app_controls_sync()
         
         # Real-time features
         self.test_geofencing()
+        self.test_shared_geofence()
         self.test_alerts_system()
+        self.test_bulk_mark_alerts_read()
         
         # Dashboard
         self.test_dashboard_data()
+        self.test_weekly_report()
+        self.test_teens_overview()
         
         # Summary
         self.print_summary()
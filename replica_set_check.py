@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Smoke check for the split ingest/read Mongo clients against a replica set.
+The read client uses secondaryPreferred with maxStalenessSeconds, which a
+standalone mongod rejects, so run this against a single-node replica set:
+
+    docker run -d --name mongo-rs -p 27017:27017 mongo:7 --replSet rs0
+    docker exec mongo-rs mongosh --quiet --eval 'rs.initiate()'
+    MONGO_URL="mongodb://localhost:27017/?replicaSet=rs0" python replica_set_check.py
+
+It writes through the ingest client, reads the document back through the
+read client, builds an index under the maintenance deadline and prints the
+pool metrics of both clients. Exits non-zero on the first failure.
+"""
+
+import asyncio
+import sys
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent / "backend"))
+from server import Settings, create_mongo_clients, mongo_timeout, pool_metrics
+
+async def check(settings):
+    ingest_client, read_client = create_mongo_clients(settings)
+    collection = f"replica_set_check_{uuid.uuid4().hex[:8]}"
+    ingest = ingest_client[settings.db_name][collection]
+    read = read_client[settings.db_name][collection]
+    try:
+        hello = await ingest_client.admin.command("hello")
+        if "setName" not in hello:
+            raise RuntimeError("MONGO_URL does not point at a replica set member")
+        print(f"✅ Replica set {hello['setName']}: {', '.join(hello.get('hosts', []))}")
+
+        doc_id = str(uuid.uuid4())
+        result = await ingest.insert_one({"_id": doc_id, "source": "ingest"})
+        if not result.acknowledged:
+            raise RuntimeError("ingest write was not acknowledged")
+        print("✅ Ingest write acknowledged (w=1)")
+
+        found = await read.find_one({"_id": doc_id})
+        if found is None:
+            raise RuntimeError("read client could not see the ingest write")
+        print(f"✅ Read client ({read_client.read_preference.name}, "
+              f"max staleness {settings.read_max_staleness_seconds}s) found the document")
+
+        with mongo_timeout(settings.maintenance_timeout_ms / 1000):
+            await ingest.create_index("source")
+        print(f"✅ Index build ran under the {settings.maintenance_timeout_ms} ms maintenance deadline")
+
+        for name, metrics in pool_metrics.items():
+            print(f"📊 {name} pool: {metrics.snapshot()}")
+    finally:
+        await ingest.drop()
+        ingest_client.close()
+        read_client.close()
+
+if __name__ == "__main__":
+    settings = Settings.from_env()
+    try:
+        asyncio.run(check(settings))
+    except Exception as e:
+        print(f"❌ {e!r}")
+        sys.exit(1)
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Throughput benchmark for the backend's offline reverse geocoder.
+Measures lookups per second against the local gazetteer, both for unique
+coordinates (index lookups) and for repeated coordinates (LRU cache hits).
+"""
+
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent / "backend"))
+from server import Gazetteer, GAZETTEER_FILE
+
+LOOKUPS = 200000
+
+def run(gazetteer, points):
+    start = time.perf_counter()
+    for latitude, longitude in points:
+        gazetteer.reverse(latitude, longitude)
+    elapsed = time.perf_counter() - start
+    return len(points) / elapsed
+
+if __name__ == "__main__":
+    gazetteer = Gazetteer.from_file(GAZETTEER_FILE)
+    random.seed(42)
+    
+    # Points scattered around gazetteer places so most lookups find a match
+    places = [place for cell in gazetteer.cells.values() for place in cell]
+    unique_points = []
+    for _ in range(LOOKUPS):
+        place = random.choice(places)
+        unique_points.append((place["latitude"] + random.uniform(-0.3, 0.3),
+                              place["longitude"] + random.uniform(-0.3, 0.3)))
+    
+    # A few stationary devices reporting the same spot over and over
+    repeated_points = [random.choice(unique_points[:100]) for _ in range(LOOKUPS)]
+    
+    print(f"📍 Gazetteer: {GAZETTEER_FILE} ({len(places)} places)")
+    print(f"Unique coordinates:   {run(gazetteer, unique_points):,.0f} lookups/sec")
+    gazetteer.lookup.cache_clear()
+    run(gazetteer, repeated_points[:100])
+    print(f"Repeated coordinates: {run(gazetteer, repeated_points):,.0f} lookups/sec")
+    print(f"Cache: {gazetteer.lookup.cache_info()}")